@@ -0,0 +1,140 @@
+"""
+Файлы из ответов ChatGPT (изображения, документы) в памяти.
+Каждый файл хранится в SpooledTemporaryFile: небольшие остаются в памяти, большие
+сбрасываются во временный файл без имени в отдельном каталоге запроса. Поэтому
+файлы разных запросов не пересекаются, а в Telegram они уходят без записи на диск
+и повторного чтения по имени.
+"""
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import file_ops
+
+logger = logging.getLogger(__name__)
+
+# Файлы больше этого размера хранятся на диске, а не в памяти
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Расширения файлов, отправляемых как фото
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+class Artifact:
+    """Один файл ответа"""
+
+    def __init__(self, name: str, scratch_dir: str):
+        self.name = name
+        self.size = 0
+        self._hash = hashlib.sha256()  # Хэш содержимого считается по мере записи
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, dir=scratch_dir)
+        self._read_lock = threading.Lock()  # Один файл могут отправлять несколько получателей сразу
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def is_image(self) -> bool:
+        return os.path.splitext(self.name)[1].lower() in IMAGE_EXTENSIONS
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def _write_base64(self, content: str):
+        self._write(base64.b64decode(content))
+
+    def _copy_from(self, path: str):
+        with open(path, 'rb') as src:
+            while chunk := src.read(1024 * 1024):
+                self._write(chunk)
+
+    def _read(self) -> bytes:
+        with self._read_lock:
+            self._file.seek(0)
+            return self._file.read()
+
+    async def write(self, data: bytes):
+        """Дозапись данных в конец файла"""
+        await file_ops.run('write', self._write, data)
+
+    async def write_base64(self, content: str):
+        """Декодирование base64 и дозапись в конец файла"""
+        await file_ops.run('write', self._write_base64, content)
+
+    async def copy_from(self, path: str):
+        """Содержимое файла с диска (например, завершенной загрузки браузера)"""
+        await file_ops.run('read', self._copy_from, path)
+
+    async def read(self) -> bytes:
+        """Все содержимое файла (для отправки в Telegram)"""
+        return await file_ops.run('read', self._read)
+
+    def close(self):
+        self._file.close()
+
+
+class ArtifactBatch:
+    """
+    Файлы одного запроса в собственном временном каталоге.
+    Один набор может достаться нескольким получателям (объединенные одинаковые
+    запросы): каждый получает ссылку через retain() и вызывает close() после отправки.
+    """
+
+    def __init__(self):
+        self.scratch_dir = tempfile.mkdtemp(prefix='tgbot-artifacts-')
+        self.items = []
+        self._names = set()
+        self._refs = 1
+
+    def new(self, name: str) -> Artifact:
+        """Новый файл; одинаковые имена в пределах запроса получают суффикс"""
+        base, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate in self._names:
+            n += 1
+            candidate = f"{base}_{n}{ext}"
+        self._names.add(candidate)
+        return Artifact(candidate, self.scratch_dir)
+
+    def add(self, artifact: Artifact):
+        """Файл скачан полностью и будет отправлен"""
+        self.items.append(artifact)
+
+    def discard(self, artifact: Artifact):
+        """Файл не удалось скачать"""
+        artifact.close()
+
+    @property
+    def images(self) -> list:
+        return [item for item in self.items if item.is_image]
+
+    @property
+    def documents(self) -> list:
+        return [item for item in self.items if not item.is_image]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def retain(self, count: int = 1):
+        """Дополнительные ссылки на набор для других получателей"""
+        self._refs += count
+
+    def close(self):
+        """Освобождение памяти и удаление временного каталога запроса (после последней ссылки)"""
+        self._refs -= 1
+        if self._refs > 0:
+            return
+        for item in self.items:
+            item.close()
+        self.items = []
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
@@ -0,0 +1,236 @@
+"""
+Поддельный Telegram Bot API для бенчмарка.
+Отдает боту сообщения симулированных пользователей через getUpdates, принимает
+его ответы (sendMessage, editMessageText, sendPhoto, ...) и отмечает запрос
+выполненным, когда в ответе пользователю появляется маркер DONE-<tag>.
+"""
+import base64
+import json
+import logging
+import re
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+# Маркер конца ответа стенда чата
+DONE_PATTERN = re.compile(r'DONE-(\S+)')
+
+# Поля, которые всегда остаются строками (остальные значения формы - JSON)
+TEXT_FIELDS = {'text', 'caption', 'filename'}
+
+# Картинка 1x1, которую получает бот при скачивании фото пользователя
+TINY_IMAGE = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+def _decode_value(key: str, value: str):
+    if key in TEXT_FIELDS:
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _parse_body(content_type: str, body: bytes) -> dict:
+    """Параметры метода из JSON, urlencoded или multipart тела"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = {'filename': part.get_filename(), 'size': len(part.get_payload(decode=True))}
+            else:
+                params[name] = _decode_value(name, part.get_content())
+        return params
+    return {key: _decode_value(key, value) for key, value in parse_qsl(body.decode('utf-8'))}
+
+
+class FakeBotApi:
+    """HTTP-сервер Bot API в отдельном потоке"""
+
+    def __init__(self, token: str = 'bench:token', host: str = '127.0.0.1', port: int = 0):
+        self.token = token
+        self.events = []  # (время, метод, chat_id, параметры)
+        self.completed = {}  # tag -> время первого ответа с маркером DONE-<tag>
+        self.first_poll = threading.Event()  # Бот запустился и ждет обновлений
+
+        self._updates = []
+        self._update_id = 0
+        self._message_id = 0
+        self._condition = threading.Condition()
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                api._dispatch(self, _parse_body(self.headers.get('Content-Type', ''), body))
+
+            def do_GET(self):
+                api._dispatch(self, {})
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    @property
+    def file_base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/file/bot'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Bot API запущен: {self.base_url}")
+
+    def stop(self):
+        with self._condition:
+            self._condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- Симуляция пользователей ---
+
+    def push_message(self, user_id: int, text: str = None, photo: bool = False, caption: str = None):
+        """Сообщение пользователя, которое бот получит через getUpdates"""
+        with self._condition:
+            self._update_id += 1
+            self._message_id += 1
+            message = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            }
+            if photo:
+                file_id = f'photo-{self._message_id}'
+                message['photo'] = [{
+                    'file_id': file_id, 'file_unique_id': file_id,
+                    'width': 1, 'height': 1, 'file_size': len(TINY_IMAGE),
+                }]
+                if caption:
+                    message['caption'] = caption
+            else:
+                message['text'] = text
+            self._updates.append({'update_id': self._update_id, 'message': message})
+            self._condition.notify_all()
+
+    def wait_for(self, tag: str, timeout: float) -> float:
+        """Ожидание ответа с маркером DONE-<tag>; время ответа или None"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while tag not in self.completed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self.completed[tag]
+
+    # --- Методы Bot API ---
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler, params: dict):
+        path = handler.path.split('?')[0]
+        if path.startswith('/file/bot'):
+            self._send(handler, 200, TINY_IMAGE, 'image/png')
+            return
+
+        method = path.rsplit('/', 1)[-1]
+        result = self._call(method, params)
+        body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self._send(handler, 200, body, 'application/json')
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, body: bytes, content_type: str):
+        try:
+            handler.send_response(status)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _message(self, chat_id, **fields) -> dict:
+        with self._condition:
+            self._message_id += 1
+            message_id = self._message_id
+        return dict({
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        }, **fields)
+
+    def _record(self, method: str, params: dict):
+        now = time.monotonic()
+        text = str(params.get('text') or params.get('caption') or '')
+        with self._condition:
+            self.events.append((now, method, params.get('chat_id'), params))
+            for tag in DONE_PATTERN.findall(text):
+                tag = tag.rstrip('*_`.')
+                if tag not in self.completed:
+                    self.completed[tag] = now
+                    self._condition.notify_all()
+
+    def _call(self, method: str, params: dict):
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(TINY_IMAGE),
+                    'file_path': f'photos/{file_id}.jpg'}
+
+        self._record(method, params)
+        chat_id = params.get('chat_id', 0)
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(chat_id, text=params.get('text', ''))
+        if method == 'sendPhoto':
+            return self._message(chat_id, photo=[{'file_id': 'out', 'file_unique_id': 'out', 'width': 1, 'height': 1}])
+        if method == 'sendDocument':
+            return self._message(chat_id, document={'file_id': 'out', 'file_unique_id': 'out'})
+        if method == 'sendMediaGroup':
+            media = params.get('media') or []
+            return [self._message(chat_id, photo=[{'file_id': 'out', 'file_unique_id': 'out', 'width': 1, 'height': 1}])
+                    for _ in media]
+        # deleteWebhook, setMyCommands, sendChatAction, deleteMessage, ...
+        return True
+
+    def _get_updates(self, params: dict) -> list:
+        """Long polling: ждем новых обновлений до timeout секунд"""
+        self.first_poll.set()
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # Подтвержденные ботом обновления больше не нужны
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return list(self._updates)
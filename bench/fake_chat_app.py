@@ -0,0 +1,69 @@
+"""
+Локальный стенд ChatGPT для бенчмарка.
+Отдает одну страницу (chat.html) на любой путь, а она повторяет DOM, на который
+опирается browser_manager.py, и печатает заготовленные ответы с заданной скоростью.
+"""
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat.html')
+
+DEFAULT_CONFIG = {
+    'token_rate': 50,  # Токенов ответа в секунду
+    'answer_tokens': 120,  # Длина ответа в токенах
+    'first_token_ms': 300,  # Задержка до первого токена
+    'upload_ms': 200,  # Имитация загрузки прикрепленного файла
+    'file_lines': 100,  # Размер файла, который "генерирует" ответ с [file]
+}
+
+
+class FakeChatApp:
+    """HTTP-сервер стенда в отдельном потоке"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, **config):
+        self.config = dict(DEFAULT_CONFIG, **config)
+        with open(PAGE_PATH, encoding='utf-8') as f:
+            template = f.read()
+        start = template.index('/*CONFIG*/') + len('/*CONFIG*/')
+        end = template.index('/*END*/')
+        self.page = (template[:start] + json.dumps(self.config) + template[end:]).encode('utf-8')
+
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/favicon'):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(app.page)))
+                self.end_headers()
+                self.wfile.write(app.page)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Стенд чата запущен: {self.url}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
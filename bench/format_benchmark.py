@@ -0,0 +1,121 @@
+"""
+Бенчмарк форматирования ответов (formatting.format_response_for_telegram).
+
+Корпус - длинные ответы 10-200 КБ: из истории переписки бота (--history-db),
+из каталога с .txt файлами (--corpus) или, если они не заданы, синтетические
+ответы с текстом, селекторами, блоками "Копировать код" и ```.
+
+Запуск из корня репозитория:
+    python -m bench.format_benchmark --history-db user_projects/history.db
+
+Код возврата 2, если пропускная способность ниже --min-throughput (МБ/с, по умолчанию
+MIN_THROUGHPUT: однопроходный разбор дает около 10 МБ/с, прежний - около 4 МБ/с).
+"""
+import argparse
+import glob
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from formatting import format_response_for_telegram
+
+MIN_SIZE = 10 * 1024
+MAX_SIZE = 200 * 1024
+
+# Целевая пропускная способность (МБ/с) по умолчанию
+MIN_THROUGHPUT = 5
+
+PROSE = [
+    "Чтобы найти поле ввода, используйте селектор #prompt-textarea или textarea[placeholder*=\"Message\"].",
+    "Если input не найден, проверьте div[contenteditable=\"true\"] и дождитесь загрузки страницы.",
+    "The textarea element is replaced by a contenteditable div in newer versions of the UI.",
+    "Ниже пример кода, который можно запустить без изменений.",
+    "Обратите внимание на `inline code` и обработку ошибок в каждом шаге.",
+]
+
+CODE = [
+    "def read_input(path):",
+    "    with open(path) as f:  # #comment input",
+    "        return [line.strip() for line in f]",
+    "",
+    "document.querySelector('textarea[name=\"q\"]').value = input;",
+]
+
+
+def synthetic_answer(size: int, rng: random.Random) -> str:
+    """Ответ примерно заданного размера в формате innerText сообщения ChatGPT"""
+    parts = []
+    length = 0
+    question = 1
+    while length < size:
+        kind = rng.random()
+        if kind < 0.6:
+            block = ' '.join(rng.choice(PROSE) for _ in range(rng.randint(1, 4)))
+        elif kind < 0.85:
+            lines = [rng.choice(CODE) for _ in range(rng.randint(3, 30))]
+            block = "python\nКопировать код\n" + '\n'.join(lines) + f"\n\nQ{question}: что дальше?"
+            question += 1
+        else:
+            lines = [rng.choice(CODE) for _ in range(rng.randint(3, 30))]
+            block = "```js\n" + '\n'.join(lines) + "\n```"
+        parts.append(block)
+        length += len(block) + 2
+    return '\n\n'.join(parts)
+
+
+def load_corpus(args) -> list:
+    corpus = []
+    if args.corpus:
+        for path in sorted(glob.glob(os.path.join(args.corpus, '*.txt'))):
+            with open(path, encoding='utf-8') as f:
+                corpus.append(f.read())
+    if args.history_db:
+        conn = sqlite3.connect(f'file:{args.history_db}?mode=ro', uri=True)
+        rows = conn.execute(
+            'SELECT response FROM messages WHERE length(response) BETWEEN ? AND ? ORDER BY id DESC LIMIT ?',
+            (MIN_SIZE, MAX_SIZE, args.samples),
+        ).fetchall()
+        conn.close()
+        corpus.extend(row[0] for row in rows)
+    if not corpus:
+        rng = random.Random(args.seed)
+        corpus = [synthetic_answer(rng.randint(MIN_SIZE, MAX_SIZE), rng) for _ in range(args.samples)]
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк форматирования ответов")
+    parser.add_argument('--corpus', default=None, help="каталог с ответами в .txt файлах")
+    parser.add_argument('--history-db', default=None, help="база истории бота (ответы 10-200 КБ)")
+    parser.add_argument('--samples', type=int, default=50, help="ответов в корпусе")
+    parser.add_argument('--rounds', type=int, default=5, help="проходов по корпусу")
+    parser.add_argument('--seed', type=int, default=1, help="seed синтетического корпуса")
+    parser.add_argument('--min-throughput', type=float, default=MIN_THROUGHPUT,
+                        help="минимально допустимо, МБ/с (0 - не проверять)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    total_bytes = sum(len(text.encode('utf-8')) for text in corpus)
+    print(f"Корпус: {len(corpus)} ответов, {total_bytes / 1024 / 1024:.1f} МБ")
+
+    timings = []
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        for text in corpus:
+            format_response_for_telegram(text)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    throughput = total_bytes / 1024 / 1024 / best
+    per_answer = best / len(corpus) * 1000
+    print(f"Лучший проход: {best:.3f} сек, {per_answer:.2f} мс на ответ, {throughput:.1f} МБ/с")
+    if args.min_throughput and throughput < args.min_throughput:
+        print(f"Ниже целевой пропускной способности {args.min_throughput} МБ/с")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
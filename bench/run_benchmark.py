@@ -0,0 +1,181 @@
+"""
+Офлайн бенчмарк бота целиком: bot.py + BrowserManager + локальный стенд чата + поддельный Bot API.
+
+Запуск из корня репозитория:
+    python -m bench.run_benchmark --users 8 --requests 5 --tabs 2
+
+Каждый симулированный пользователь отправляет запросы последовательно: следующий
+уходит после получения ответа на предыдущий. Время ответа - от отправки сообщения
+до первого сообщения/правки бота, содержащей полный ответ (маркер DONE-<tag>).
+"""
+import argparse
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench.fake_bot_api import FakeBotApi
+from bench.fake_chat_app import FakeChatApp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: list, p: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def parse_stage_metrics(text: str) -> dict:
+    """stage -> (count, sum) из гистограммы tgbot_stage_seconds"""
+    stages = {}
+    for line in text.splitlines():
+        if not line.startswith(('tgbot_stage_seconds_sum', 'tgbot_stage_seconds_count')):
+            continue
+        name, value = line.rsplit(' ', 1)
+        stage = name.split('stage="', 1)[1].split('"', 1)[0]
+        count, total = stages.get(stage, (0, 0.0))
+        if name.startswith('tgbot_stage_seconds_sum'):
+            total = float(value)
+        else:
+            count = int(float(value))
+        stages[stage] = (count, total)
+    return stages
+
+
+def simulate_user(api: FakeBotApi, user_id: int, index: int, args, results: list):
+    """Последовательные запросы одного пользователя"""
+    for j in range(args.requests):
+        tag = f'u{index}-{j}'
+        photo = args.photo_every and (j + 1) % args.photo_every == 0
+        directives = ' '.join(d for d in ('[image]' if args.images else '', '[file]' if args.files else '') if d)
+        prompt = f'q:{tag} benchmark request {directives}'.strip()
+
+        sent = time.monotonic()
+        if photo:
+            api.push_message(user_id, photo=True, caption=prompt)
+        else:
+            api.push_message(user_id, text=prompt)
+        answered = api.wait_for(tag, args.timeout)
+        results.append((tag, 'photo' if photo else 'text', sent, None if answered is None else answered - sent))
+        if args.think_time:
+            time.sleep(args.think_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк бота")
+    parser.add_argument('--users', type=int, default=4, help="симулированных пользователей")
+    parser.add_argument('--requests', type=int, default=3, help="запросов на пользователя")
+    parser.add_argument('--tabs', type=int, default=2, help="вкладок браузера (BROWSER_TABS)")
+    parser.add_argument('--token-rate', type=float, default=50, help="скорость ответа стенда, токенов/сек")
+    parser.add_argument('--answer-tokens', type=int, default=120, help="длина ответа в токенах")
+    parser.add_argument('--first-token-ms', type=int, default=300, help="задержка до первого токена")
+    parser.add_argument('--photo-every', type=int, default=0, help="каждый N-й запрос - фото (0 - без фото)")
+    parser.add_argument('--images', action='store_true', help="ответы содержат сгенерированное изображение")
+    parser.add_argument('--files', action='store_true', help="ответы содержат файл для скачивания")
+    parser.add_argument('--streaming', action='store_true', help="включить STREAMING в боте")
+    parser.add_argument('--think-time', type=float, default=0, help="пауза пользователя между запросами, сек")
+    parser.add_argument('--timeout', type=float, default=180, help="таймаут ответа на запрос, сек")
+    parser.add_argument('--metrics-port', type=int, default=9118, help="порт /metrics бота")
+    parser.add_argument('--headed', action='store_true', help="показывать окно браузера")
+    parser.add_argument('--bot-log', default=None, help="файл для вывода bot.py (по умолчанию скрыт)")
+    args = parser.parse_args()
+
+    chat_app = FakeChatApp(
+        token_rate=args.token_rate,
+        answer_tokens=args.answer_tokens,
+        first_token_ms=args.first_token_ms,
+    )
+    api = FakeBotApi()
+    chat_app.start()
+    api.start()
+
+    workdir = tempfile.mkdtemp(prefix='tgbot-bench-')
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=api.token,
+        TELEGRAM_API_BASE_URL=api.base_url,
+        TELEGRAM_FILE_BASE_URL=api.file_base_url,
+        CHATGPT_URL=chat_app.url,
+        CHATGPT_PROFILE_PATH=os.path.join(workdir, 'profile'),
+        HEADLESS='false' if args.headed else 'true',
+        BROWSER_TABS=str(args.tabs),
+        STREAMING='true' if args.streaming else 'false',
+        METRICS_PORT=str(args.metrics_port),
+        # Квоты не должны влиять на замер
+        MAX_QUEUE_DEPTH='100000',
+        USER_REQUESTS_PER_MINUTE='100000',
+        USER_BURST='100000',
+    )
+    log = open(args.bot_log, 'w') if args.bot_log else subprocess.DEVNULL
+    # bot.py пишет user_projects/ и debug/ в текущий каталог - запускаем во временном
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], cwd=workdir, env=env,
+                           stdout=log, stderr=subprocess.STDOUT)
+
+    try:
+        print("Ожидание запуска бота...")
+        while not api.first_poll.wait(1):
+            if bot.poll() is not None:
+                print(f"bot.py завершился с кодом {bot.returncode}")
+                return 1
+
+        results = []
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=simulate_user, args=(api, 1000 + i, i, args, results))
+            for i in range(args.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        latencies = [latency for *_, latency in results if latency is not None]
+        timeouts = len(results) - len(latencies)
+        print()
+        print(f"Пользователей: {args.users}, запросов: {len(results)}, вкладок: {args.tabs}, "
+              f"стриминг: {'да' if args.streaming else 'нет'}")
+        print(f"Время: {elapsed:.1f} сек, пропускная способность: {len(latencies) / elapsed * 60:.1f} запр/мин")
+        print(f"Таймаутов: {timeouts}")
+        if latencies:
+            print("Время ответа, сек: " + ", ".join(
+                f"p{p}={percentile(latencies, p):.2f}" for p in (50, 90, 95, 99)
+            ) + f", max={max(latencies):.2f}")
+
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{args.metrics_port}/metrics', timeout=5) as response:
+                stages = parse_stage_metrics(response.read().decode('utf-8'))
+        except Exception as e:
+            print(f"Метрики этапов недоступны: {e}")
+            stages = {}
+        if stages:
+            print()
+            print(f"{'этап':<20}{'кол-во':>8}{'среднее, сек':>15}")
+            for stage, (count, total) in sorted(stages.items(), key=lambda item: -item[1][1]):
+                if count:
+                    print(f"{stage:<20}{count:>8}{total / count:>15.3f}")
+        return 0 if not timeouts else 2
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(15)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        if log is not subprocess.DEVNULL:
+            log.close()
+        api.stop()
+        chat_app.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
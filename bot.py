@@ -1,12 +1,25 @@
 import os
 import logging
-import re
 from dotenv import load_dotenv
-from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import NetworkError, TimedOut, RetryAfter
-from browser_manager import BrowserManager
+from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest, NetworkError, TimedOut, RetryAfter
+from browser_manager import BrowserManager, IncompleteResponse
+from scheduler import FairScheduler, Job, SchedulerBusy
+from message_editor import get_chat_editor
+from history_store import HistoryStore
+from formatting import FormattedResponse, IncrementalFormatter, format_response_for_telegram
+from message_splitter import split_message
+from artifacts import ArtifactBatch
+from file_id_cache import FileIdCache
+from ttl_cache import TTLCache
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+import tracing
+import file_ops
 import asyncio
+import html
+import time
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -27,103 +40,38 @@ logging.getLogger('telegram').setLevel(logging.WARNING)
 # Глобальный менеджер браузера
 browser_manager = None
 
-# Словарь для отслеживания активных запросов пользователей
-active_requests = {}
+# HTTP-эндпоинт с метриками (если включен)
+metrics_server = None
 
+# Планировщик запросов: очереди пользователей, квоты и честная очередность
+scheduler = None
 
-def format_response_for_telegram(response: str) -> str:
-    """
-    Форматирование ответа ChatGPT для Telegram.
-    Исправляет проблему склеивания кодовых блоков с текстом после них.
-    Оборачивает селекторы и код в блоки форматирования.
-    """
-    try:
-        # Оборачиваем CSS селекторы и подобные элементы в инлайн-код
-        # Паттерны для поиска селекторов и кода
-        patterns = [
-            (r"(#[\w-]+)", r"`\1`"),  # ID селекторы: #prompt-textarea
-            (r"(\w+\[[\w*=\"'-]+\])", r"`\1`"),  # Атрибутные селекторы: textarea[placeholder*="Message"]
-            (r"(div\[contenteditable=\"true\"\])", r"`\1`"),  # Специфичные селекторы
-            (r"(\btextarea\b(?!\[))", r"`\1`"),  # Одиночные теги
-            (r"(\binput\b(?!\[))", r"`\1`"),  # Одиночные теги
-        ]
-        
-        for pattern, replacement in patterns:
-            response = re.sub(pattern, replacement, response)
-        
-        # Убираем двойные обратные кавычки если они появились
-        response = re.sub(r'`+', '`', response)
-        
-        # Ищем паттерн "Копировать код" и извлекаем код после него
-        if "Копировать код" in response or "Copy code" in response:
-            # Разбиваем на части по "Копировать код"
-            parts = re.split(r'(Копировать код|Copy code)', response)
-            
-            formatted_parts = []
-            i = 0
-            while i < len(parts):
-                part = parts[i]
-                
-                # Если это текст "Копировать код"
-                if part in ["Копировать код", "Copy code"]:
-                    # Следующая часть содержит код
-                    if i + 1 < len(parts):
-                        code_block = parts[i + 1]
-                        
-                        # Извлекаем код до первого Q (Q1, Q2 и т.д.)
-                        lines = code_block.split('\n')
-                        
-                        # Ищем где заканчивается код (первый Q)
-                        code_lines = []
-                        remaining_lines = []
-                        found_q = False
-                        
-                        for idx, line in enumerate(lines):
-                            # Если нашли строку начинающуюся с Q и цифры
-                            if not found_q and re.match(r'^\s*Q\d+', line.strip(), re.IGNORECASE):
-                                found_q = True
-                                # Все что после Q - это обычный текст
-                                remaining_lines = lines[idx:]
-                                break
-                            # Добавляем строку кода
-                            code_lines.append(line)
-                        
-                        # Убираем пустые строки в начале кода
-                        while code_lines and not code_lines[0].strip():
-                            code_lines.pop(0)
-                        
-                        # Убираем пустые строки в конце кода
-                        while code_lines and not code_lines[-1].strip():
-                            code_lines.pop()
-                        
-                        # Форматируем код в markdown
-                        if code_lines:
-                            code_text = '\n'.join(code_lines)
-                            formatted_parts.append(f"```\n{code_text}\n```")
-                        
-                        # Добавляем остальной текст после кода (вопросы Q1, Q2 и т.д.)
-                        if remaining_lines:
-                            remaining_text = '\n'.join(remaining_lines)
-                            if remaining_text.strip():
-                                formatted_parts.append(remaining_text.strip())
-                        
-                        i += 2  # Пропускаем "Копировать код" и блок кода
-                        continue
-                
-                # Обычный текст
-                if part.strip():
-                    formatted_parts.append(part.strip())
-                
-                i += 1
-            
-            return '\n\n'.join(formatted_parts)
-        
-        # Если нет "Копировать код", возвращаем как есть
-        return response
-        
-    except Exception as e:
-        logger.error(f"Ошибка форматирования ответа: {e}")
-        return response
+# История переписки (SQLite)
+history_store = None
+
+# file_id уже отправленных файлов по хэшу содержимого
+file_id_cache = None
+
+# Кэш ответов на повторяющиеся запросы (None - выключен)
+response_cache = None
+
+# Объединение одинаковых одновременных запросов (None - выключено)
+single_flight = None
+
+# Недавно полученные фото пользователей по file_unique_id (пересланные фото не скачиваются повторно)
+photo_cache = TTLCache(
+    max_entries=int(os.getenv('PHOTO_CACHE_SIZE', '50')),
+    ttl=float(os.getenv('PHOTO_CACHE_TTL', '600')),
+)
+
+# Записей истории на одной странице /history
+HISTORY_PAGE_SIZE = 5
+
+# Стриминг: ответ появляется в сообщении по мере генерации в браузере
+STREAMING = os.getenv('STREAMING', 'false').lower() == 'true'
+
+# Минимальный интервал между правками сообщений в одном чате (сек)
+EDIT_INTERVAL = float(os.getenv('EDIT_INTERVAL', '1.0'))
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -140,6 +88,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Показать это сообщение\n"
         "/help - Справка по использованию\n"
         "/status - Статус бота\n"
+        "/history - История запросов\n"
+        "/fresh - Запрос без использования сохраненного ответа\n"
         "/clear - Очистить историю (скоро)\n\n"
         "💡 <b>Как использовать:</b>\n"
         "Просто отправьте мне текст или фото, и я передам запрос в ChatGPT!\n\n"
@@ -148,46 +98,61 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(welcome_message, parse_mode='HTML')
 
 
-async def send_animated_text(update: Update, full_text: str, chunk_size: int = 100, delay: float = 0.5):
+async def send_animated_text(update: Update, full_text: str, entities: list = None,
+                             chunk_size: int = 100, delay: float = 0.5):
     """
     Отправляет текст с анимацией постепенного появления.
-    Показывает индикатор 'печатает' и постепенно добавляет текст.
+    Показывает индикатор 'печатает' и постепенно добавляет текст;
+    частоту правок ограничивает редактор чата. Разметка (entities) - в финальном кадре.
     """
+    message = update.message
     try:
-        message = update.message
-        bot = update.get_bot()
+        editor = get_chat_editor(update.get_bot(), message.chat.id, EDIT_INTERVAL)
         
         # Показываем индикатор "печатает"
-        await bot.send_chat_action(message.chat.id, "typing")
+        await editor.typing()
         
         # Отправляем начальное сообщение
-        sent_message = await message.reply_text("✍️", parse_mode='Markdown')
+        sent_message = await message.reply_text("✍️")
         
-        # Постепенно добавляем текст
-        for i in range(0, len(full_text), chunk_size):
-            # Показываем индикатор "печатает" перед каждым обновлением
-            await bot.send_chat_action(message.chat.id, "typing")
-            
-            chunk = full_text[:i + chunk_size]
-            try:
-                await sent_message.edit_text(chunk, parse_mode='Markdown')
-            except Exception as e:
-                # Игнорируем ошибки если текст не изменился или слишком частые обновления
-                logger.debug(f"Ошибка редактирования сообщения: {e}")
-                pass
-            
+        # Постепенно добавляем текст (промежуточные кадры без разметки)
+        for i in range(chunk_size, len(full_text), chunk_size):
+            editor.update(sent_message.message_id, full_text[:i])
+            await editor.typing()
             await asyncio.sleep(delay)
         
         # Финальное обновление с полным текстом
-        try:
-            await sent_message.edit_text(full_text, parse_mode='Markdown')
-        except:
-            pass
+        if not await editor.finish(sent_message.message_id, full_text, entities=entities):
+            await editor.finish(sent_message.message_id, full_text)
             
     except Exception as e:
         logger.error(f"Ошибка анимации текста: {e}")
         # В случае ошибки просто отправляем текст обычным способом
-        await message.reply_text(full_text, parse_mode='Markdown')
+        await message.reply_text(full_text, entities=entities)
+
+
+def make_stream_handler(update: Update, message):
+    """
+    Обработчик стриминга для browser_manager: показывает в сообщении текущий
+    текст ответа через редактор чата, который сам ограничивает частоту правок.
+    Форматируются только новые строки ответа, незакрытые блоки кода и разметка
+    в промежуточном тексте закрываются.
+    """
+    editor = get_chat_editor(update.get_bot(), message.chat.id, EDIT_INTERVAL)
+    formatter = IncrementalFormatter()
+    
+    async def on_text(offset: int, chunk: str):
+        formatter.feed(chunk, offset)
+        preview, parse_mode = formatter.snapshot(), 'Markdown'
+        if not preview.strip():
+            return
+        if len(preview) > 4000:
+            # Хвост длинного ответа - без разметки: обрезка могла разорвать блок кода
+            preview, parse_mode = "…" + preview[-4000:], None
+        editor.update(message.message_id, preview + " ▌", parse_mode=parse_mode)
+        await editor.typing()
+    
+    return on_text
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -204,9 +169,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Для каждого пользователя автоматически создается проект.\n"
         "Вся история сохраняется в вашем проекте.\n\n"
         "⚠️ <b>Важно:</b>\n"
-        "• Дождитесь ответа на предыдущий запрос\n"
+        "• Новые сообщения встают в очередь и обрабатываются по порядку\n"
         "• Генерация ответа может занять до 2 минут\n"
-        "• История сохраняется локально\n\n"
+        "• История сохраняется локально, посмотреть ее - /history\n"
+        "• На повторный вопрос может прийти сохраненный ответ; /fresh <i>вопрос</i> - спросить заново\n\n"
         "❓ Возникли проблемы? Используйте /status"
     )
     await update.message.reply_text(help_text, parse_mode='HTML')
@@ -215,40 +181,218 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /status"""
     user_id = str(update.effective_user.id)
-    is_processing = user_id in active_requests and active_requests[user_id]
+    is_processing = scheduler.is_busy(user_id) if scheduler else False
     
     status_text = (
         "📊 <b>Статус бота</b>\n\n"
         f"🔹 Браузер: {'✅ Активен' if browser_manager and browser_manager.browser else '❌ Не запущен'}\n"
         f"🔹 Ваш ID: <code>{user_id}</code>\n"
         f"🔹 Обработка запроса: {'⏳ Да' if is_processing else '✅ Нет'}\n"
-        f"🔹 Активных запросов: {sum(1 for v in active_requests.values() if v)}\n\n"
+        f"🔹 Ваших запросов в очереди: {scheduler.pending(user_id) if scheduler else 0}\n"
+        f"🔹 Активных запросов: {scheduler.running_count() if scheduler else 0}\n"
+        f"🔹 Запросов в очереди: {scheduler.pending_count() if scheduler else 0}\n"
+        f"🔹 Среднее время ответа: ~{int(scheduler.latency.value) if scheduler else 0} сек\n"
+        f"🔹 Занято вкладок: {browser_manager.pool.busy_count() if browser_manager else 0}"
+        f"/{browser_manager.pool.size if browser_manager else 0}\n\n"
         "Все системы работают нормально! 🚀"
     )
     await update.message.reply_text(status_text, parse_mode='HTML')
 
 
+def format_history_page(entries: list) -> tuple:
+    """
+    Текст страницы истории (HTML) в пределах лимита сообщения.
+    
+    Returns:
+        tuple: (текст, сколько записей поместилось)
+    """
+    parts = []
+    length = 0
+    for entry in entries:
+        query = entry.query if len(entry.query) <= 200 else entry.query[:200] + "…"
+        response = entry.response if len(entry.response) <= 400 else entry.response[:400] + "…"
+        icon = "🖼️" if entry.kind == 'photo' else "💬"
+        part = (
+            f"{icon} <b>{time.strftime('%d.%m.%Y %H:%M', time.localtime(entry.ts))}</b>\n"
+            f"<b>Запрос:</b> {html.escape(query) or '—'}\n"
+            f"<b>Ответ:</b> {html.escape(response)}"
+        )
+        if parts and length + len(part) > 3800:
+            break
+        parts.append(part)
+        length += len(part) + 2
+    return "\n\n".join(parts), len(parts)
+
+
+async def render_history_page(user_id: str, cursor: str = None) -> tuple:
+    """Страница истории пользователя: (текст, клавиатура для перехода к более старым)"""
+    entries, next_cursor = await history_store.page(user_id, HISTORY_PAGE_SIZE, cursor)
+    if not entries:
+        return "📭 История пуста", None
+    
+    text, shown = format_history_page(entries)
+    if shown < len(entries):
+        # Не все записи поместились - следующая страница начнется с первой непоказанной
+        next_cursor = entries[shown - 1].cursor
+    
+    markup = None
+    if next_cursor:
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Раньше", callback_data=f"history:{next_cursor}")]])
+    return "📜 <b>История запросов</b>\n\n" + text, markup
+
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /history"""
+    if not history_store:
+        await update.message.reply_text("История не сохраняется")
+        return
+    text, markup = await render_history_page(str(update.effective_user.id))
+    await update.message.reply_text(text, parse_mode='HTML', reply_markup=markup)
+
+
+async def history_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка перехода к более старым записям истории"""
+    query = update.callback_query
+    await query.answer()
+    if not history_store:
+        return
+    cursor = query.data.split(':', 1)[1]
+    text, markup = await render_history_page(str(update.effective_user.id), cursor)
+    await query.edit_message_text(text, parse_mode='HTML', reply_markup=markup)
+
+
+def record_receive(update: Update, job: Job):
+    """Учет задержки доставки сообщения от Telegram до бота"""
+    with tracing.request_context(job.request_id, job.user_id):
+        tracing.record('telegram_receive', max(0.0, time.time() - update.message.date.timestamp()))
+
+
+async def submit_job(update: Update, job: Job) -> bool:
+    """Передача задачи планировщику с ответом о позиции в очереди или перегрузке (False - не принята)"""
+    try:
+        position = await scheduler.submit(job)
+    except SchedulerBusy as busy:
+        wait = max(1, int(busy.retry_after))
+        if busy.reason == 'rate':
+            text = (
+                "🚦 <b>Слишком много запросов</b>\n\n"
+                f"Попробуйте снова через ~{wait} сек."
+            )
+        else:
+            text = (
+                "⏳ <b>Бот сейчас перегружен</b>\n\n"
+                f"Попробуйте снова через ~{wait} сек."
+            )
+        await update.message.reply_text(text, parse_mode='HTML')
+        return False
+    
+    if position > 0:
+        await update.message.reply_text(
+            "📥 <b>Запрос добавлен в очередь</b>\n\n"
+            f"Перед ним ваших запросов: {position}.\n"
+            f"Примерное ожидание: ~{int(scheduler.estimate_wait(position))} сек.",
+            parse_mode='HTML'
+        )
+    return True
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
     user = update.effective_user
     username = str(user.id)  # Используем Telegram ID
     query = update.message.text
     
-    # Проверка на активный запрос
-    if username in active_requests and active_requests[username]:
+    logger.info(f"Получен запрос от ID {username}: {query}")
+    
+    if response_cache is not None:
+        cached = response_cache.get(username, query)
+        if cached is not None:
+            logger.info(f"Ответ для ID {username} взят из кэша")
+            await send_cached_response(update, username, query, cached)
+            return
+    
+    await submit_text_query(update, username, query)
+
+
+async def fresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /fresh: запрос в ChatGPT мимо кэша ответов"""
+    username = str(update.effective_user.id)
+    # Текст после команды целиком, с переносами строк (context.args их теряет)
+    parts = update.message.text.split(maxsplit=1)
+    query = parts[1] if len(parts) > 1 else ''
+    if not query.strip():
         await update.message.reply_text(
-            "⏳ <b>Подождите!</b>\n\n"
-            "Ваш предыдущий запрос еще обрабатывается.\n"
-            "Пожалуйста, дождитесь ответа.",
+            "Напишите вопрос после команды, например: <i>/fresh Расскажи про Python</i>",
             parse_mode='HTML'
         )
         return
     
-    # Отмечаем что запрос в обработке
-    active_requests[username] = True
+    logger.info(f"Получен запрос без кэша от ID {username}: {query}")
+    if response_cache is not None:
+        response_cache.bypass()
     
-    logger.info(f"Получен запрос от ID {username}: {query}")
+    await submit_text_query(update, username, query)
+
+
+async def submit_text_query(update: Update, username: str, query: str):
+    """Постановка текстового запроса в очередь или присоединение к такому же выполняющемуся"""
+    flight = None
+    if single_flight is not None:
+        flight = single_flight.join(username, query)
+        if flight is not None:
+            await process_joined_text(update, username, query, flight)
+            return
+        flight = single_flight.begin(username, query)
     
+    job = Job(username, 'text', lambda: process_text_job(update, username, query, flight))
+    record_receive(update, job)
+    if not await submit_job(update, job) and flight is not None:
+        flight.fail(RuntimeError("запрос не принят в очередь, повторите его"))
+
+
+def response_markdown(response: str) -> str:
+    """Ответ в Telegram Markdown: разметка, собранная из страницы, или восстановленная по тексту"""
+    if isinstance(response, FormattedResponse):
+        return response.markdown
+    return format_response_for_telegram(response)
+
+
+async def process_joined_text(update: Update, username: str, query: str, flight):
+    """Ответ на запрос, присоединенный к такому же выполняющемуся: без своей генерации в браузере"""
+    processing_msg = await update.message.reply_text(
+        "⏳ <b>Такой же запрос уже обрабатывается</b>\n\n"
+        "Ответ придет, как только он будет готов.",
+        parse_mode='HTML'
+    )
+    
+    artifacts = None
+    try:
+        response, artifacts = await flight.wait()
+        formatted_response = response_markdown(response)
+        await deliver_text_response(update, processing_msg, formatted_response, streamed=False)
+        await send_downloaded_files(update, artifacts)
+        # Ведущий запрос сохранил в историю только свой ответ
+        history_store.append(username, 'text', query, response)
+    except Exception as e:
+        logger.error(f"Ошибка обработки присоединенного запроса: {e}")
+        await processing_msg.edit_text(f"❌ <b>Произошла ошибка:</b>\n\n{html.escape(str(e))}", parse_mode='HTML')
+    finally:
+        if artifacts is not None:
+            artifacts.close()
+
+
+async def send_cached_response(update: Update, username: str, query: str, response: str):
+    """Ответ из кэша: сразу целиком, без анимации"""
+    await send_message_parts(update, split_message(response_markdown(response)))
+    history_store.append(username, 'text', query, response)
+
+
+async def process_text_job(update: Update, username: str, query: str, flight=None):
+    """Выполнение текстового запроса из очереди пользователя
+    
+    Args:
+        flight: объединение одинаковых запросов, которым передается результат (или None)
+    """
     # Отправка уведомления о начале обработки
     processing_msg = await update.message.reply_text(
         "⏳ <b>Обрабатываю ваш запрос...</b>\n\n"
@@ -256,59 +400,149 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='HTML'
     )
     
+    artifacts = None
     try:
-        # Отправка запроса через браузер
-        response, downloaded_files = await browser_manager.create_project_and_send_query(username, query)
+        # Отправка запроса через браузер (в режиме стриминга ответ сразу появляется в сообщении)
+        on_text = make_stream_handler(update, processing_msg) if STREAMING else None
+        response, artifacts = await browser_manager.create_project_and_send_query(username, query, on_text=on_text)
+        if flight is not None:
+            flight.resolve(response, artifacts)
         
-        # Удаление сообщения о обработке
-        await processing_msg.delete()
+        # В кэш попадают только полные текстовые ответы: файлы из кэша не отправить
+        if response_cache is not None and not isinstance(response, IncompleteResponse) and not artifacts:
+            await response_cache.put(username, query, response)
         
         # Форматируем ответ для Telegram
-        formatted_response = format_response_for_telegram(response)
+        with tracing.span('format'):
+            formatted_response = response_markdown(response)
         
-        # Отправка ответа с анимацией (разбиваем на части если слишком длинный)
-        if len(formatted_response) > 4096:
-            # Для очень длинных ответов отправляем по частям без анимации
-            for i in range(0, len(formatted_response), 4096):
-                await update.message.reply_text(formatted_response[i:i+4096], parse_mode='Markdown')
-        else:
-            # Для обычных ответов используем анимацию
-            await send_animated_text(update, formatted_response)
-        
-        # Отправка файлов если есть
-        if downloaded_files:
-            await update.message.reply_text(f"📎 Отправляю {len(downloaded_files)} файл(ов)...")
-            
-            for filepath in downloaded_files:
-                try:
-                    # Проверяем тип файла по расширению
-                    file_ext = os.path.splitext(filepath)[1].lower()
-                    
-                    # Если это изображение - отправляем как фото
-                    if file_ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-                        with open(filepath, 'rb') as f:
-                            await update.message.reply_photo(photo=f)
-                        logger.info(f"Изображение отправлено: {filepath}")
-                    else:
-                        # Остальные файлы отправляем как документы
-                        with open(filepath, 'rb') as f:
-                            await update.message.reply_document(document=f, filename=os.path.basename(filepath))
-                        logger.info(f"Файл отправлен: {filepath}")
-                    
-                    # Удаляем файл после отправки
-                    os.remove(filepath)
-                    logger.info(f"Файл удален: {filepath}")
-                    
-                except Exception as file_error:
-                    logger.error(f"Ошибка отправки файла {filepath}: {file_error}")
-                    await update.message.reply_text(f"⚠️ Не удалось отправить файл: {os.path.basename(filepath)}")
+        with tracing.span('telegram_delivery'):
+            await deliver_text_response(update, processing_msg, formatted_response, streamed=on_text is not None)
+            await send_downloaded_files(update, artifacts)
             
     except Exception as e:
         logger.error(f"Ошибка обработки сообщения: {e}")
         await processing_msg.edit_text(f"❌ <b>Произошла ошибка:</b>\n\n{str(e)}", parse_mode='HTML')
     finally:
-        # Снимаем флаг обработки
-        active_requests[username] = False
+        # Присоединенные запросы не должны ждать вечно, если результата не будет
+        if flight is not None:
+            flight.fail(RuntimeError("не удалось получить ответ ChatGPT"))
+        # Файлы ответа больше не нужны: освобождаем память и временный каталог запроса
+        if artifacts is not None:
+            artifacts.close()
+
+
+async def send_message_parts(update: Update, parts: list):
+    """Отправка частей ответа с заранее разобранной разметкой (text, entities)"""
+    for text, entities in parts:
+        await update.message.reply_text(text, entities=entities)
+
+
+async def deliver_text_response(update: Update, processing_msg, formatted_response: str, streamed: bool,
+                                animate: bool = True):
+    """Отправка отформатированного ответа: разметка разбирается в боте, длинный ответ делится на части"""
+    parts = split_message(formatted_response) or [("Пустой ответ", [])]
+    if streamed and len(parts) == 1:
+        # Финальное обновление сообщения, в которое стримился ответ
+        text, entities = parts[0]
+        editor = get_chat_editor(update.get_bot(), processing_msg.chat.id, EDIT_INTERVAL)
+        if not await editor.finish(processing_msg.message_id, text, entities=entities):
+            await editor.finish(processing_msg.message_id, text)
+        return
+    
+    # Удаление сообщения о обработке
+    await processing_msg.delete()
+    
+    if len(parts) > 1 or not animate:
+        # Длинные ответы отправляем по частям без анимации
+        await send_message_parts(update, parts)
+    else:
+        # Для обычных ответов используем анимацию
+        text, entities = parts[0]
+        await send_animated_text(update, text, entities)
+
+
+# Максимум элементов в одном альбоме Telegram
+MEDIA_GROUP_SIZE = 10
+
+
+def sent_file_ids(messages: list, as_photo: bool) -> list:
+    """file_id отправленных файлов (в том же порядке, что и файлы)"""
+    if as_photo:
+        return [message.photo[-1].file_id if message.photo else None for message in messages]
+    return [message.document.file_id if message.document else None for message in messages]
+
+
+async def send_file_group(update: Update, items: list, as_photo: bool, use_cache: bool = True):
+    """Отправка до 10 файлов одного вида: альбомом или одиночным сообщением.
+    Файлы, которые уже отправлялись с тем же содержимым, передаются по file_id без загрузки.
+    """
+    kind = 'photo' if as_photo else 'document'
+    cached = [
+        file_id_cache.get(kind, item.sha256, item.size) if file_id_cache and use_cache else None
+        for item in items
+    ]
+    # Содержимое читаем только для файлов, которых нет в кэше
+    contents = list(cached)
+    missing = [i for i, file_id in enumerate(cached) if not file_id]
+    for i, data in zip(missing, await asyncio.gather(*(items[i].read() for i in missing))):
+        contents[i] = data
+    
+    try:
+        if len(items) == 1:
+            if as_photo:
+                message = await update.message.reply_photo(photo=contents[0], filename=items[0].name)
+            else:
+                message = await update.message.reply_document(document=contents[0], filename=items[0].name)
+            messages = [message]
+        else:
+            media_type = InputMediaPhoto if as_photo else InputMediaDocument
+            messages = await update.message.reply_media_group(
+                media=[media_type(media=data, filename=item.name) for data, item in zip(contents, items)]
+            )
+    except BadRequest as e:
+        if not any(cached):
+            raise
+        # Telegram не принял сохраненный file_id - забываем его и загружаем файлы заново
+        logger.warning(f"Сохраненный file_id отклонен ({e}), загружаем файлы заново")
+        for item, file_id in zip(items, cached):
+            if file_id:
+                await file_id_cache.forget(kind, item.sha256, item.size)
+        await send_file_group(update, items, as_photo, use_cache=False)
+        return
+    
+    if file_id_cache:
+        for item, file_id, new_file_id in zip(items, cached, sent_file_ids(messages, as_photo)):
+            if new_file_id and not file_id:
+                await file_id_cache.put(kind, item.sha256, item.size, new_file_id)
+
+
+async def send_downloaded_files(update: Update, artifacts: ArtifactBatch):
+    """Отправка скачанных из ChatGPT файлов: изображения и документы отдельными альбомами"""
+    for items, as_photo in ((artifacts.images, True), (artifacts.documents, False)):
+        for i in range(0, len(items), MEDIA_GROUP_SIZE):
+            group = items[i:i + MEDIA_GROUP_SIZE]
+            try:
+                await send_file_group(update, group, as_photo)
+                logger.info(f"Отправлено {'изображений' if as_photo else 'файлов'}: {len(group)}")
+                continue
+            except Exception as group_error:
+                if len(group) == 1:
+                    failed = group
+                    logger.error(f"Ошибка отправки файла {group[0].name}: {group_error}")
+                else:
+                    # Альбом отклоняется целиком из-за одного файла - остальные отправляем по одному
+                    logger.warning(f"Альбом из {len(group)} файлов не отправлен ({group_error}), отправляем по одному")
+                    failed = []
+                    for item in group:
+                        try:
+                            await send_file_group(update, [item], as_photo)
+                        except Exception as file_error:
+                            logger.error(f"Ошибка отправки файла {item.name}: {file_error}")
+                            failed.append(item)
+            if failed:
+                names = ", ".join(item.name for item in failed)
+                await update.message.reply_text(f"⚠️ Не удалось отправить файлы: {names}")
 
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -317,21 +551,15 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = str(user.id)
     caption = update.message.caption or ""
     
-    # Проверка на активный запрос
-    if username in active_requests and active_requests[username]:
-        await update.message.reply_text(
-            "⏳ <b>Подождите!</b>\n\n"
-            "Ваш предыдущий запрос еще обрабатывается.\n"
-            "Пожалуйста, дождитесь ответа.",
-            parse_mode='HTML'
-        )
-        return
-    
-    # Отмечаем что запрос в обработке
-    active_requests[username] = True
-    
     logger.info(f"Получено фото от ID {username}" + (f" с текстом: {caption}" if caption else ""))
     
+    job = Job(username, 'photo', lambda: process_photo_job(update, username, caption))
+    record_receive(update, job)
+    await submit_job(update, job)
+
+
+async def process_photo_job(update: Update, username: str, caption: str):
+    """Выполнение запроса с фото из очереди пользователя"""
     # Отправка уведомления о начале обработки
     processing_msg = await update.message.reply_text(
         "📸 <b>Обрабатываю фото...</b>\n\n"
@@ -339,83 +567,58 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='HTML'
     )
     
+    artifacts = None
     try:
         # Получаем фото (берем самое большое разрешение)
-        photo = update.message.photo[-1]
-        photo_file = await photo.get_file()
-        
-        # Скачиваем фото
-        import os
-        os.makedirs("temp_photos", exist_ok=True)
-        photo_path = f"temp_photos/{username}_{photo.file_id}.jpg"
-        await photo_file.download_to_drive(photo_path)
-        
-        logger.info(f"Фото сохранено: {photo_path}")
-        
-        # Отправка фото и текста в ChatGPT
-        response, downloaded_files = await browser_manager.send_photo_query(username, photo_path, caption)
+        with tracing.span('photo_fetch'):
+            photo = update.message.photo[-1]
+            
+            # Пересланное или повторно отправленное фото берем из кэша, иначе скачиваем в память
+            photo_data = photo_cache.get(photo.file_unique_id)
+            if photo_data is None:
+                photo_file = await photo.get_file()
+                photo_data = bytes(await photo_file.download_as_bytearray())
+                photo_cache.put(photo.file_unique_id, photo_data)
+                logger.info(f"Фото получено: {len(photo_data)} байт")
+            else:
+                logger.info(f"Фото взято из кэша: {len(photo_data)} байт")
         
-        # Удаление временного файла
-        try:
-            os.remove(photo_path)
-        except:
-            pass
+        # Отправка фото и текста в ChatGPT (в режиме стриминга ответ сразу появляется в сообщении)
+        on_text = make_stream_handler(update, processing_msg) if STREAMING else None
+        response, artifacts = await browser_manager.send_photo_query(
+            username, photo_data, caption, on_text=on_text, filename=f"{photo.file_unique_id}.jpg"
+        )
         
-        # Удаление сообщения о обработке
-        await processing_msg.delete()
+        with tracing.span('format'):
+            formatted_response = "*🖼️ Ответ ChatGPT:*\n\n" + response_markdown(response)
         
         # Отправка ответа
-        if len(response) > 4096:
-            for i in range(0, len(response), 4096):
-                await update.message.reply_text(response[i:i+4096])
-        else:
-            await update.message.reply_text(f"🖼️ <b>Ответ ChatGPT:</b>\n\n{response}", parse_mode='HTML')
-        
-        # Отправка файлов если есть
-        if downloaded_files:
-            await update.message.reply_text(f"📎 Отправляю {len(downloaded_files)} файл(ов)...")
+        with tracing.span('telegram_delivery'):
+            await deliver_text_response(update, processing_msg, formatted_response, streamed=on_text is not None,
+                                        animate=False)
             
-            for filepath in downloaded_files:
-                try:
-                    # Проверяем тип файла по расширению
-                    file_ext = os.path.splitext(filepath)[1].lower()
-                    
-                    # Если это изображение - отправляем как фото
-                    if file_ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-                        with open(filepath, 'rb') as f:
-                            await update.message.reply_photo(photo=f)
-                        logger.info(f"Изображение отправлено: {filepath}")
-                    else:
-                        # Остальные файлы отправляем как документы
-                        with open(filepath, 'rb') as f:
-                            await update.message.reply_document(document=f, filename=os.path.basename(filepath))
-                        logger.info(f"Файл отправлен: {filepath}")
-                    
-                    # Удаляем файл после отправки
-                    os.remove(filepath)
-                    logger.info(f"Файл удален: {filepath}")
-                    
-                except Exception as file_error:
-                    logger.error(f"Ошибка отправки файла {filepath}: {file_error}")
-                    await update.message.reply_text(f"⚠️ Не удалось отправить файл: {os.path.basename(filepath)}")
+            # Отправка файлов если есть
+            await send_downloaded_files(update, artifacts)
             
     except Exception as e:
         logger.error(f"Ошибка обработки фото: {e}")
         await processing_msg.edit_text(f"❌ <b>Произошла ошибка:</b>\n\n{str(e)}", parse_mode='HTML')
     finally:
-        # Снимаем флаг обработки
-        active_requests[username] = False
+        if artifacts is not None:
+            artifacts.close()
 
 
 async def post_init(application: Application):
     """Инициализация после запуска бота"""
-    global browser_manager
+    global browser_manager, scheduler, metrics_server, history_store, file_id_cache, response_cache, single_flight
     
     # Установка команд бота
     commands = [
         BotCommand("start", "Начать работу с ботом"),
         BotCommand("help", "Справка по использованию"),
         BotCommand("status", "Проверить статус бота"),
+        BotCommand("history", "История запросов"),
+        BotCommand("fresh", "Спросить заново, без сохраненного ответа"),
     ]
     await application.bot.set_my_commands(commands)
     
@@ -424,20 +627,80 @@ async def post_init(application: Application):
     is_docker = os.path.exists('/.dockerenv')
     headless_mode = is_docker or os.getenv('HEADLESS', 'false').lower() == 'true'
     
-    browser_manager = BrowserManager(profile_path, headless=headless_mode)
+    # Количество вкладок браузера, обрабатывающих запросы параллельно
+    tabs = int(os.getenv('BROWSER_TABS', '1'))
     
-    logger.info(f"Запуск браузера (headless={headless_mode})...")
+    # Файловые операции выполняются в отдельном пуле потоков, задержка цикла событий - в метриках
+    file_ops.configure(int(os.getenv('FILE_IO_WORKERS', '4')))
+    file_ops.start_lag_monitor()
+    
+    # История переписки: запись в фоне, старые записи удаляются через HISTORY_RETENTION_DAYS дней
+    history_store = HistoryStore(
+        os.getenv('HISTORY_DB', './user_projects/history.db'),
+        retention_days=float(os.getenv('HISTORY_RETENTION_DAYS', '0')),
+    )
+    history_store.start()
+    
+    # Повторно отправляемые файлы передаются в Telegram по file_id, а не загружаются заново
+    file_id_cache = FileIdCache(
+        os.getenv('FILE_ID_CACHE', './user_projects/file_id_cache.json'),
+        max_entries=int(os.getenv('FILE_ID_CACHE_SIZE', '5000')),
+    )
+    
+    # Кэш ответов: off - выключен, user - свой для каждого пользователя, global - общий
+    cache_scope = os.getenv('RESPONSE_CACHE', 'off').lower()
+    if cache_scope != 'off':
+        response_cache = ResponseCache(
+            os.getenv('RESPONSE_CACHE_PATH', './user_projects/response_cache.json'),
+            scope=cache_scope,
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', '86400')),
+            max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '1000')),
+        )
+        logger.info(f"Кэш ответов включен (область: {cache_scope})")
+    
+    # Одинаковые одновременные запросы: off - выполняются отдельно, user/global - одна генерация на всех
+    coalescing_scope = os.getenv('QUERY_COALESCING', 'off').lower()
+    if coalescing_scope != 'off':
+        single_flight = SingleFlight(coalescing_scope)
+        logger.info(f"Объединение одинаковых запросов включено (область: {coalescing_scope})")
+    
+    browser_manager = BrowserManager(profile_path, headless=headless_mode, tabs=tabs, history=history_store)
+    
+    logger.info(f"Запуск браузера (headless={headless_mode}, вкладок={tabs})...")
     success = await browser_manager.start()
     
     if success:
         logger.info("Браузер успешно запущен и готов к работе")
     else:
         logger.error("Не удалось запустить браузер")
+    
+    # Планировщик: по одному исполнителю на вкладку браузера
+    scheduler = FairScheduler(
+        workers=tabs,
+        max_queue_depth=int(os.getenv('MAX_QUEUE_DEPTH', '50')),
+        user_rate=float(os.getenv('USER_REQUESTS_PER_MINUTE', '6')) / 60,
+        user_burst=float(os.getenv('USER_BURST', '3')),
+    )
+    scheduler.start()
+    
+    # Метрики этапов обработки: HTTP-эндпоинт в формате Prometheus и JSONL-трасса
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        metrics_server = await tracing.start_metrics_server(int(metrics_port))
+    trace_file = os.getenv('TRACE_FILE')
+    if trace_file:
+        tracing.configure_trace_file(trace_file)
 
 
 async def post_shutdown(application: Application):
     """Очистка ресурсов при остановке"""
     global browser_manager
+    if scheduler:
+        await scheduler.stop()
+    await tracing.shutdown(metrics_server)
+    if history_store:
+        await history_store.stop()
+    await file_ops.shutdown()
     if browser_manager:
         try:
             logger.info("Остановка браузера...")
@@ -482,8 +745,16 @@ def main():
         return
     
     # Создание приложения с улучшенными настройками для стабильности
+    builder = Application.builder()
+    
+    # Альтернативный Bot API сервер (локальный сервер или стенд бенчмарка)
+    api_base_url = os.getenv('TELEGRAM_API_BASE_URL')
+    if api_base_url:
+        file_base_url = os.getenv('TELEGRAM_FILE_BASE_URL', api_base_url.replace('/bot', '/file/bot'))
+        builder = builder.base_url(api_base_url).base_file_url(file_base_url)
+    
     application = (
-        Application.builder()
+        builder
         .token(token)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
@@ -495,6 +766,7 @@ def main():
         .get_updates_read_timeout(30.0)
         .get_updates_write_timeout(30.0)
         .get_updates_pool_timeout(30.0)
+        .concurrent_updates(True)  # Запросы разных пользователей обрабатываются параллельно во вкладках пула
         .build()
     )
     
@@ -502,6 +774,9 @@ def main():
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("fresh", fresh_command))
+    application.add_handler(CallbackQueryHandler(history_page_callback, pattern=r'^history:'))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
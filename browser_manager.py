@@ -1,42 +1,455 @@
 import os
 import asyncio
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
-from pathlib import Path
 import logging
 
+from page_pool import NoHealthyPages, PagePool, PageSlot
+import wait_conditions as waits
+from selector_registry import registry as selector_registry
+from project_index import ProjectIndex, project_url_from
+import tracing
+import file_ops
+from artifacts import Artifact, ArtifactBatch
+from formatting import FormattedResponse
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Адрес ChatGPT (переопределяется для локального стенда бенчмарка)
+CHATGPT_URL = os.getenv('CHATGPT_URL', 'https://chatgpt.com/')
+
+# Ответы ChatGPT на странице
+RESPONSE_SELECTOR = 'div[data-message-author-role="assistant"]'
+
+# Сообщения пользователя (запросы) на странице
+QUERY_SELECTOR = 'div[data-message-author-role="user"]'
+
+# Признаки идущей генерации: кнопка остановки или стриминг текста
+STREAMING_SELECTOR = (
+    'button[data-testid="stop-button"], '
+    'button[aria-label*="Stop"], '
+    'button[aria-label*="Остановить"], '
+    '.result-streaming'
+)
+
+# Кнопки "Поделиться" у сгенерированных изображений
+IMAGE_BUTTON_SELECTOR = (
+    'button[aria-label*="Поделиться этим изображением"], '
+    'button[aria-label*="Share this image"]'
+)
+
+# Сообщение об ошибке генерации вместо ответа
+ERROR_SELECTOR = (
+    '[data-testid*="error-message"], '
+    '.text-token-text-error'
+)
+
+# Максимальное время генерации ответа (сек)
+GENERATION_TIMEOUT = 120
+
+# Поиск ошибки генерации (общая часть скриптов ниже): ошибка учитывается, только
+# если она стоит после последнего ответа, бывшего до запроса, и после последнего
+# сообщения пользователя (самого запроса) - старые ошибки в переписке не считаются.
+# Возвращает текст ошибки или null.
+FIND_ERROR_JS = '''
+    const findError = () => {
+        const messages = document.querySelectorAll(selector);
+        const queries = document.querySelectorAll(userSelector);
+        const anchors = [baseline > 0 ? messages[baseline - 1] : null, queries[queries.length - 1]].filter(Boolean);
+        const follows = (anchor, node) => {
+            const position = anchor.compareDocumentPosition(node);
+            return (position & Node.DOCUMENT_POSITION_FOLLOWING) && !(position & Node.DOCUMENT_POSITION_CONTAINED_BY);
+        };
+        const error = Array.from(document.querySelectorAll(errorSelector)).find(
+            (node) => anchors.every((anchor) => follows(anchor, node))
+        );
+        return error ? error.textContent.trim().slice(0, 300) : null;
+    };
+'''
+
+# Скрипт ожидания окончания генерации: MutationObserver проверяет состояние
+# страницы при каждом изменении DOM и разрешает промис, когда появился новый
+# ответ и индикатор генерации исчез. Если индикатор так и не появился
+# (изменилась верстка), ответ считается готовым после idleMs без изменений.
+# Если вместо ответа появилась ошибка, промис разрешается ее текстом ({error}).
+GENERATION_DONE_JS = '''
+({selector, userSelector, streamingSelector, imageSelector, errorSelector, baseline, quietMs, idleMs}) =>
+new Promise((resolve) => {''' + FIND_ERROR_JS + '''
+    let sawStreaming = false;
+    let timer = null;
+    const hasAnswer = () => {
+        const messages = document.querySelectorAll(selector);
+        if (messages.length <= baseline) {
+            return false;
+        }
+        // Ответ из одного изображения не содержит текста
+        const last = messages[messages.length - 1];
+        return last.innerText.trim().length > 0 || !!last.querySelector('img, ' + imageSelector);
+    };
+    const finish = () => {
+        observer.disconnect();
+        resolve(true);
+    };
+    const check = () => {
+        const error = findError();
+        if (error) {
+            clearTimeout(timer);
+            observer.disconnect();
+            resolve({error});
+            return;
+        }
+        const streaming = !!document.querySelector(streamingSelector);
+        sawStreaming = sawStreaming || streaming;
+        if (timer) {
+            clearTimeout(timer);
+            timer = null;
+        }
+        if (!streaming && hasAnswer()) {
+            timer = setTimeout(finish, sawStreaming ? quietMs : idleMs);
+        }
+    };
+    const observer = new MutationObserver(check);
+    observer.observe(document.body, {childList: true, subtree: true, characterData: true, attributes: true});
+    check();
+})
+'''
+
+# Снимок состояния страницы для резервного опроса - все за один вызов: число
+# ответов, длина и хэш последнего нового ответа, кнопки изображений в нем,
+# индикатор генерации и текст ошибки после запроса
+PROBE_JS = '''
+({selector, userSelector, baseline, streamingSelector, imageSelector, errorSelector}) => {''' + FIND_ERROR_JS + '''
+    const messages = document.querySelectorAll(selector);
+    const last = messages.length > baseline ? messages[messages.length - 1] : null;
+    const text = last ? last.textContent : '';
+    let hash = 0x811c9dc5;
+    for (let i = 0; i < text.length; i++) {
+        hash = Math.imul(hash ^ text.charCodeAt(i), 0x01000193);
+    }
+    return {
+        count: messages.length,
+        length: text.length,
+        hash: hash >>> 0,
+        images: last ? last.querySelectorAll(imageSelector).length : 0,
+        streaming: !!document.querySelector(streamingSelector),
+        error: findError(),
+    };
+}
+'''
+
+# Стриминг ответа: MutationObserver на последнем ответе не чаще раза в throttleMs
+# передает в Python изменившийся хвост текста (смещение + новые символы)
+STREAM_START_JS = '''
+({selector, baseline, throttleMs}) => {
+    if (window.__tgStreamObserver) {
+        window.__tgStreamObserver.disconnect();
+    }
+    let sent = '';
+    let timer = null;
+    const push = () => {
+        timer = null;
+        const messages = document.querySelectorAll(selector);
+        if (messages.length <= baseline) {
+            return;
+        }
+        const text = messages[messages.length - 1].innerText;
+        if (text === sent) {
+            return;
+        }
+        // offset передается в символах (code points), как индекс строки в Python,
+        // а не в единицах UTF-16: эмодзи занимают две единицы
+        const isLow = (code) => code >= 0xDC00 && code <= 0xDFFF;
+        let offset = 0;
+        let points = 0;
+        const max = Math.min(text.length, sent.length);
+        while (offset < max && text.charCodeAt(offset) === sent.charCodeAt(offset)) {
+            if (!isLow(text.charCodeAt(offset))) {
+                points++;
+            }
+            offset++;
+        }
+        // Суррогатная пара не разрывается: изменение начинается с ее первой половины
+        if (offset > 0 && offset < text.length && isLow(text.charCodeAt(offset))) {
+            offset--;
+            points--;
+        }
+        window.__tgStreamPush({offset: points, text: text.slice(offset)});
+        sent = text;
+    };
+    const observer = new MutationObserver(() => {
+        if (!timer) {
+            timer = setTimeout(push, throttleMs);
+        }
+    });
+    observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+    window.__tgStreamObserver = observer;
+    window.__tgStreamFlush = push;
+}
+'''
+
+STREAM_STOP_JS = '''
+() => {
+    if (window.__tgStreamObserver) {
+        window.__tgStreamFlush();
+        window.__tgStreamObserver.disconnect();
+        window.__tgStreamObserver = null;
+    }
+}
+'''
+
+# Сколько файлов ответа сохраняется одновременно
+ARTIFACT_CONCURRENCY = 4
+
+# Размер фрагмента при скачивании blob-файлов со страницы
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# Загрузка blob по ссылке и сохранение его на странице до конца скачивания: [id, размер]
+BLOB_OPEN_JS = '''
+async (url) => {
+    const blob = await (await fetch(url)).blob();
+    window.__tgBlobs = window.__tgBlobs || {};
+    const id = Math.random().toString(36).slice(2);
+    window.__tgBlobs[id] = blob;
+    return [id, blob.size];
+}
+'''
+
+# Фрагмент blob [start, end) в base64
+BLOB_READ_JS = '''
+({id, start, end}) => new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onloadend = () => resolve(reader.result.split(',', 2)[1] || '');
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(window.__tgBlobs[id].slice(start, end));
+})
+'''
+
+BLOB_CLOSE_JS = '''
+(id) => { if (window.__tgBlobs) delete window.__tgBlobs[id]; }
+'''
+
+# Разбор последнего ответа за один вызов: обход DOM сообщения с выводом Markdown
+# (подмножество, которое понимает message_splitter) и список вложений. Блоки кода
+# берутся с языком из класса language-*, таблицы выводятся моноширинным блоком,
+# кнопки интерфейса пропускаются. Ссылки на файлы помечаются data-tg-artifact,
+# чтобы потом найти их без повторного поиска по странице.
+EXTRACT_ANSWER_JS = r'''
+({selector, baseline}) => {
+    const messages = document.querySelectorAll(selector);
+    if (messages.length <= baseline) {
+        return null;
+    }
+    const root = messages[messages.length - 1];
+    const artifacts = [];
+    const BLOCK = new Set(['P', 'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'UL', 'OL', 'PRE', 'TABLE',
+                           'BLOCKQUOTE', 'HR', 'DIV', 'SECTION', 'ARTICLE', 'FIGURE']);
+    const SKIP = new Set(['BUTTON', 'SVG', 'svg', 'STYLE', 'SCRIPT', 'TEXTAREA', 'INPUT']);
+
+    // Метки файлов от прошлых ответов не должны совпасть с новыми
+    for (const marked of document.querySelectorAll('[data-tg-artifact]')) {
+        marked.removeAttribute('data-tg-artifact');
+    }
+
+    const escape = (text) => text.replace(/([*_`\[])/g, '\\$1');
+    const squash = (text) => text.replace(/\s+/g, ' ');
+    // Внутри сущности экранирование не работает - убираем ее ограничители
+    const raw = (node, strip) => squash(node.textContent || '').replace(strip, '').trim();
+
+    const inline = (node) => {
+        if (node.nodeType === Node.TEXT_NODE) {
+            return escape(squash(node.textContent));
+        }
+        if (node.nodeType !== Node.ELEMENT_NODE || SKIP.has(node.tagName)) {
+            return '';
+        }
+        const tag = node.tagName;
+        if (tag === 'BR') {
+            return '\n';
+        }
+        if (tag === 'IMG') {
+            artifacts.push({kind: 'image', name: node.alt || '', href: node.currentSrc || node.src || ''});
+            return '';
+        }
+        if (tag === 'CODE') {
+            const code = squash(node.textContent).replace(/`/g, "'").trim();
+            return code ? '`' + code + '`' : '';
+        }
+        if (tag === 'STRONG' || tag === 'B' || tag === 'EM' || tag === 'I') {
+            // Вложенной разметки в Telegram Markdown нет - внутри только текст
+            const mark = (tag === 'STRONG' || tag === 'B') ? '*' : '_';
+            const text = raw(node, mark === '*' ? /\*/g : /_/g);
+            return text ? mark + text + mark : '';
+        }
+        if (tag === 'A') {
+            const href = node.getAttribute('href') || '';
+            // Файлы ответа - только ссылки с download и blob:; обычная ссылка со словом
+            // download в адресе (страница загрузок) остается ссылкой в тексте
+            if (href && (node.hasAttribute('download') || href.startsWith('blob:'))) {
+                const index = artifacts.length;
+                node.setAttribute('data-tg-artifact', String(index));
+                artifacts.push({kind: 'file', name: node.getAttribute('download') || '', href, index});
+                return '';
+            }
+            if (/^https?:\/\//.test(node.href) && raw(node, /[\[\]]/g)) {
+                return '[' + raw(node, /[\[\]]/g) + '](' + node.href.replace(/\)/g, '%29') + ')';
+            }
+            return escape(squash(node.textContent || ''));
+        }
+        let out = '';
+        for (const child of node.childNodes) {
+            out += inline(child);
+        }
+        return out;
+    };
+
+    const table = (node) => {
+        const rows = Array.from(node.querySelectorAll('tr')).map(
+            (tr) => Array.from(tr.children).map((cell) => squash(cell.textContent).trim())
+        );
+        if (!rows.length) {
+            return '';
+        }
+        const widths = [];
+        for (const row of rows) {
+            row.forEach((cell, i) => { widths[i] = Math.max(widths[i] || 0, cell.length); });
+        }
+        const line = (row) => widths.map((width, i) => (row[i] || '').padEnd(width)).join(' | ').trimEnd();
+        const lines = [line(rows[0]), widths.map((width) => '-'.repeat(width)).join('-+-')];
+        for (const row of rows.slice(1)) {
+            lines.push(line(row));
+        }
+        return '```\n' + lines.join('\n').replace(/```/g, '`\u200b``') + '\n```';
+    };
+
+    const list = (node, depth) => {
+        const lines = [];
+        let number = parseInt(node.getAttribute('start') || '1', 10);
+        for (const item of node.children) {
+            if (item.tagName !== 'LI') {
+                continue;
+            }
+            let text = '';
+            const nested = [];
+            for (const child of item.childNodes) {
+                if (child.nodeType === Node.ELEMENT_NODE && (child.tagName === 'UL' || child.tagName === 'OL')) {
+                    nested.push(list(child, depth + 1));
+                } else if (child.nodeType === Node.ELEMENT_NODE && child.tagName === 'PRE') {
+                    nested.push(block(child));
+                } else {
+                    text += inline(child);
+                }
+            }
+            const marker = node.tagName === 'OL' ? (number++) + '. ' : '• ';
+            lines.push('  '.repeat(depth) + marker + text.trim());
+            lines.push(...nested.filter(Boolean));
+        }
+        return lines.join('\n');
+    };
+
+    const block = (node) => {
+        const tag = node.tagName;
+        if (/^H[1-6]$/.test(tag)) {
+            const text = raw(node, /\*/g);
+            return text ? '*' + text + '*' : '';
+        }
+        if (tag === 'PRE') {
+            const code = node.querySelector('code');
+            let match = code && code.className.match(/language-([\w+#.-]+)/);
+            if (!match && code && node.firstElementChild && !node.firstElementChild.contains(code)) {
+                // Язык в шапке блока рядом с кнопкой копирования
+                const header = node.firstElementChild.textContent.replace(/Копировать код|Copy code/g, '').trim();
+                match = header.match(/^([A-Za-z][\w+#.-]{0,19})$/);
+            }
+            const text = (code || node).textContent.replace(/\n+$/, '').replace(/```/g, '`\u200b``');
+            return text.trim() ? '```' + (match ? match[1] : '') + '\n' + text + '\n```' : '';
+        }
+        if (tag === 'UL' || tag === 'OL') {
+            return list(node, 0);
+        }
+        if (tag === 'TABLE') {
+            return table(node);
+        }
+        if (tag === 'HR') {
+            return '———';
+        }
+        if (tag === 'BLOCKQUOTE') {
+            return container(node).split('\n').map((line) => '> ' + line).join('\n');
+        }
+        return container(node);
+    };
+
+    const container = (node) => {
+        const blocks = [];
+        let paragraph = '';
+        const flush = () => {
+            const text = paragraph.replace(/ *\n */g, '\n').trim();
+            if (text) {
+                blocks.push(text);
+            }
+            paragraph = '';
+        };
+        for (const child of node.childNodes) {
+            if (child.nodeType === Node.ELEMENT_NODE && BLOCK.has(child.tagName) && !SKIP.has(child.tagName)) {
+                flush();
+                const text = block(child);
+                if (text.trim()) {
+                    blocks.push(text);
+                }
+            } else {
+                paragraph += inline(child);
+            }
+        }
+        flush();
+        return blocks.join('\n\n');
+    };
+
+    return {text: root.innerText, markdown: container(root), artifacts};
+}
+'''
+
+
+class GenerationError(Exception):
+    """ChatGPT показал сообщение об ошибке вместо ответа на запрос"""
+
+
+class IncompleteResponse(str):
+    """Текст ошибки или ответ, дочитанный не до конца (по таймауту).
+    Ведет себя как обычная строка, но такой ответ нельзя переиспользовать (кэшировать).
+    """
+
 
 class BrowserManager:
-    def __init__(self, profile_path: str, headless: bool = False):
+    def __init__(self, profile_path: str, headless: bool = False, tabs: int = 1,
+                 project_index_path: str = './user_projects/project_index.json', history=None):
         self.profile_path = profile_path
         self.playwright = None
         self.browser: Browser = None
         self.context: BrowserContext = None
-        self.first_request = True  # Флаг для первого запроса
         self.headless = headless  # Режим работы браузера
-        self.current_user_id = None  # Текущий активный пользователь
+        self.pool = PagePool(tabs)  # Пул вкладок, у каждой свое состояние
+        self._restart_lock = asyncio.Lock()  # Перезапуск браузера выполняется одной задачей
+        self._stream_queues = {}  # page -> asyncio.Queue с фрагментами стримящегося ответа
+        self._answer_files = {}  # page -> файлы последнего ответа, найденные при его разборе
+        self.projects = ProjectIndex(project_index_path)  # Адреса проектов пользователей
+        self.history = history  # HistoryStore для сохранения переписки (None - не сохранять)
         
     async def _save_debug_snapshot(self, page: Page, action: str = ""):
         """Сохранение отладочного снимка страницы"""
         try:
-            import os
-            os.makedirs('./debug', exist_ok=True)
+            await file_ops.makedirs('./debug')
             
             # Сохраняем HTML
             html_content = await page.content()
-            with open('./debug/current_page.html', 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            await file_ops.write_text('./debug/current_page.html', html_content)
             
             # Сохраняем скриншот
             await page.screenshot(path='./debug/current_screenshot.png', full_page=True)
             
             # Сохраняем информацию
-            with open('./debug/current_info.txt', 'w', encoding='utf-8') as f:
-                f.write(f"Action: {action}\n")
-                f.write(f"URL: {page.url}\n")
-                f.write(f"Title: {await page.title()}\n")
+            await file_ops.write_text(
+                './debug/current_info.txt',
+                f"Action: {action}\nURL: {page.url}\nTitle: {await page.title()}\n"
+            )
             
             logger.debug(f"Debug snapshot saved: {action}")
         except Exception as e:
@@ -63,273 +476,291 @@ class BrowserManager:
             
             logger.info("Браузер успешно запущен")
             
-            # Сразу открываем ChatGPT
-            pages = self.browser.pages
-            if pages:
-                page = pages[0]
-                logger.info("Открытие ChatGPT...")
-                await page.goto('https://chatgpt.com/', wait_until='domcontentloaded', timeout=60000)
-                
-                # Ждем исчезновения спиннера загрузки
-                logger.info("Ожидание завершения загрузки...")
-                await asyncio.sleep(10)
-                
-                await self._save_debug_snapshot(page, "После открытия ChatGPT")
-                
-                # Проверяем и проходим капчу (с ожиданием загрузки)
-                await self._check_and_solve_captcha(page)
-                await self._save_debug_snapshot(page, "После проверки капчи")
-                
-                logger.info("ChatGPT открыт и готов к работе")
-            else:
-                logger.warning("Нет открытых страниц, создаем новую...")
-                page = await self.browser.new_page()
-                await page.goto('https://chatgpt.com/', wait_until='domcontentloaded', timeout=60000)
-                await self._check_and_solve_captcha(page)
+            # Открываем вкладки пула: первая - уже существующая страница профиля
+            pages = list(self.browser.pages)
+            for slot in self.pool.slots:
+                page = pages[slot.index] if slot.index < len(pages) else await self.browser.new_page()
+                slot.attach(page)
             
+            logger.info(f"Открытие ChatGPT во вкладках: {self.pool.size}")
+            await asyncio.gather(*(self._open_chatgpt(slot) for slot in self.pool.slots))
+            await self.pool.notify()
+            
+            logger.info("ChatGPT открыт и готов к работе")
             return True
         except Exception as e:
             logger.error(f"Ошибка запуска браузера: {e}", exc_info=True)
             return False
     
-    async def send_photo_query(self, username: str, photo_path: str, caption: str = "") -> tuple:
-        """Отправка фото с текстом в ChatGPT
+    async def _open_chatgpt(self, slot: PageSlot):
+        """Открытие ChatGPT во вкладке пула"""
+        page = slot.page
+        # Канал для стриминга ответа из страницы в Python (сохраняется между навигациями)
+        await page.expose_binding(
+            '__tgStreamPush', lambda source, data: self._on_stream_push(source['page'], data)
+        )
+        await page.goto(CHATGPT_URL, wait_until='domcontentloaded', timeout=60000)
+        
+        # Ждем исчезновения спиннера загрузки: появится поле ввода или капча
+        logger.info(f"Ожидание завершения загрузки (вкладка #{slot.index})...")
+        if not await waits.wait_for_app_ready(page, timeout=30):
+            logger.warning(f"Вкладка #{slot.index}: поле ввода не появилось за 30 сек")
+        
+        await self._save_debug_snapshot(page, f"После открытия ChatGPT (вкладка #{slot.index})")
+        
+        # Проверяем и проходим капчу (с ожиданием загрузки)
+        await self._check_and_solve_captcha(page)
+        await self._save_debug_snapshot(page, f"После проверки капчи (вкладка #{slot.index})")
+        slot.healthy = True
+    
+    async def _recover_slot(self, slot: PageSlot):
+        """Восстановление упавшей вкладки, а при падении всего браузера - перезапуск"""
+        slot.healthy = False
+        
+        # Сначала пробуем заменить только саму вкладку
+        if self.browser:
+            try:
+                try:
+                    await slot.page.close()
+                except Exception:
+                    pass
+                slot.attach(await self.browser.new_page())
+                await self._open_chatgpt(slot)
+                logger.info(f"Вкладка #{slot.index} пересоздана")
+                return
+            except Exception as e:
+                logger.warning(f"Не удалось пересоздать вкладку #{slot.index}: {e}")
+        
+        # Браузер недоступен целиком - перезапускаем его (один раз для всех вкладок)
+        async with self._restart_lock:
+            if slot.healthy:
+                # Браузер уже перезапущен другой задачей
+                return
+            logger.warning("Браузер упал, перезапускаем...")
+            await self.stop()
+            await asyncio.sleep(2)
+            if await self.start():
+                logger.info("Браузер перезапущен")
+            else:
+                logger.error("Не удалось перезапустить браузер")
+    
+    async def _prepare_page(self, slot: PageSlot, username: str, label: str):
+        """Подготовка вкладки: обновление при первом запросе и открытие проекта пользователя"""
+        page = slot.page
+        
+        # Обновление страницы только при первом запросе во вкладке
+        if slot.first_request:
+            logger.info("Обновление страницы (F5)...")
+            await page.reload(wait_until='domcontentloaded', timeout=60000)
+            logger.info("Ожидание полной загрузки страницы...")
+            
+            # Ждем исчезновения спиннера или появления поля ввода
+            if await waits.wait_for_input_ready(page, timeout=15):
+                logger.info("Страница загружена")
+            else:
+                logger.warning("Поле ввода не появилось за 15 сек после обновления")
+            
+            await self._save_debug_snapshot(page, f"После обновления F5 ({label})")
+            slot.first_request = False
+        
+        # Проверка и создание/открытие проекта (только если не в чате)
+        with tracing.span('open_project'):
+            project_exists = await self._check_and_open_project(slot, username)
+        await self._save_debug_snapshot(page, f"После проверки проекта ({label})")
+        
+        if not project_exists:
+            # Создание нового проекта только если его нет
+            logger.info(f"Создаем новый проект для {username}")
+            with tracing.span('create_project'):
+                created = await self._create_new_project(page, username)
+            await self._save_debug_snapshot(page, "После создания проекта")
+            if not created:
+                # Иначе запрос ушел бы в проект, открытый во вкладке для предыдущего пользователя
+                raise RuntimeError(f"не удалось открыть или создать проект пользователя {username}")
+            # Адрес нового проекта запоминаем, чтобы в следующий раз открыть его напрямую
+            await self.projects.set(username, page.url)
+        else:
+            logger.info(f"Используем существующий чат для {username}")
+        
+        # Вкладка теперь принадлежит этому пользователю
+        slot.current_user_id = username
+        slot.project_url = page.url
+    
+    async def _collect_files(self, page: Page) -> ArtifactBatch:
+        """Скачивание сгенерированных изображений и файлов из ответа
+        
+        Действия в интерфейсе (окно "Поделиться", клик по ссылке) выполняются по очереди,
+        а сохранение начатых загрузок и чтение blob-файлов - параллельно, не больше
+        ARTIFACT_CONCURRENCY одновременно.
+        """
+        batch = ArtifactBatch()
+        semaphore = asyncio.Semaphore(ARTIFACT_CONCURRENCY)
+        tasks = []
+        
+        async def limited(stage: str, coro):
+            async with semaphore:
+                with tracing.span(stage):
+                    return await coro
+        
+        try:
+            # Сначала проверяем сгенерированные изображения
+            images = await self._check_for_generated_images(page, log=True)
+            for idx, share_button in enumerate(images):
+                download = await self._start_image_download(page, share_button, idx)
+                if download:
+                    artifact = batch.new(download.suggested_filename or f'generated_image_{idx + 1}.png')
+                    tasks.append(limited('image_download', self._save_download(download, artifact, batch)))
+            
+            # Затем проверяем обычные файлы: ссылки уже найдены при разборе ответа
+            files = await self._resolve_answer_files(page)
+            if files is None:
+                files = await self._check_for_files(page)
+            if files:
+                logger.info(f"Обнаружено файлов для скачивания: {len(files)}")
+            for file_info in files:
+                if 'blob:' in file_info['href']:
+                    # Blob читается со страницы без действий в интерфейсе - можно параллельно
+                    tasks.append(limited('file_download', self._download_file(page, file_info, batch)))
+                else:
+                    with tracing.span('file_download'):
+                        await self._download_file(page, file_info, batch)
+            
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Ошибка скачивания файла: {result}")
+            return batch
+        except BaseException:
+            batch.close()
+            raise
+    
+    async def _save_download(self, download, artifact: Artifact, batch: ArtifactBatch):
+        """Ожидание завершения начатой загрузки и перенос файла в artifact"""
+        try:
+            # path() ждет окончания загрузки; файл браузера копируется без промежуточного имени
+            path = await download.path()
+            await artifact.copy_from(path)
+            batch.add(artifact)
+            logger.info(f"✓ Файл успешно скачан: {artifact.name} ({artifact.size} байт)")
+        except BaseException:
+            batch.discard(artifact)
+            raise
+        finally:
+            try:
+                await download.delete()
+            except Exception:
+                pass
+    
+    async def _run_job(self, username: str, label: str, send) -> tuple:
+        """Выполнение задачи пользователя в свободной вкладке пула с повторными попытками
+        
+        Args:
+            send: корутина-функция (page) -> response_text, отправляющая запрос
         
         Returns:
-            tuple: (response_text, list_of_downloaded_files)
+            tuple: (response_text, ArtifactBatch со скачанными файлами)
         """
         max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                # Создание директории проекта пользователя
-                user_project_path = Path(f"./user_projects/{username}")
-                user_project_path.mkdir(parents=True, exist_ok=True)
-                
-                # Используем существующую страницу
-                pages = self.browser.pages
-                if pages:
-                    page: Page = pages[0]
-                else:
-                    page: Page = await self.browser.new_page()
-                    await page.goto('https://chatgpt.com/', wait_until='domcontentloaded', timeout=60000)
-                    await asyncio.sleep(3)
-                
-                logger.info(f"Отправка фото от пользователя {username}")
-                
-                # Обновление страницы только при первом запросе
-                if self.first_request:
-                    logger.info("Ожидание 5 секунд перед обновлением...")
-                    await asyncio.sleep(5)
-                    logger.info("Обновление страницы (F5)...")
-                    await page.keyboard.press('F5')
-                    logger.info("Ожидание полной загрузки страницы...")
+        if self._restart_lock.locked():
+            # Браузер перезапускается - вкладки появятся после его завершения
+            async with self._restart_lock:
+                pass
+        try:
+            with tracing.span('page_acquire'):
+                slot = await self.pool.acquire(username)
+        except NoHealthyPages as e:
+            logger.error(f"Запрос ({label}) от {username} не выполнен: {e}")
+            return IncompleteResponse("Ошибка: браузер недоступен, попробуйте позже"), ArtifactBatch()
+        try:
+            for attempt in range(max_retries):
+                try:
+                    logger.info(f"Обработка запроса ({label}) от {username} во вкладке #{slot.index}")
                     
-                    # Ждем исчезновения спиннера или появления поля ввода
-                    for i in range(15):
-                        await asyncio.sleep(1)
-                        # Проверяем есть ли поле ввода
-                        input_check = await page.query_selector('textarea, div[contenteditable="true"]')
-                        if input_check:
-                            logger.info(f"Страница загружена через {i+1} сек")
-                            break
-                        if i % 3 == 0:
-                            logger.info(f"Ожидание загрузки... ({i+1} сек)")
+                    await self._prepare_page(slot, username, label)
                     
-                    await self._save_debug_snapshot(page, "После обновления F5 (фото)")
-                    self.first_request = False
-                
-                # Проверка и создание/открытие проекта (только если не в чате)
-                project_exists = await self._check_and_open_project(page, username)
-                await self._save_debug_snapshot(page, "После проверки проекта (фото)")
-                
-                if not project_exists:
-                    logger.info(f"Создаем новый проект для {username}")
-                    await self._create_new_project(page, username)
-                else:
-                    logger.info(f"Используем существующий чат для {username}")
-                
-                # Отправка фото с текстом
-                response = await self._send_photo_and_get_response(page, photo_path, caption)
-                
-                # Проверяем наличие файлов и изображений в ответе
-                downloaded_files = []
-                
-                # Сначала проверяем сгенерированные изображения
-                images = await self._check_for_generated_images(page, log=True)
-                if images:
-                    download_path = f"./temp_downloads/{username}"
+                    # Отправка запроса
+                    response = await send(slot.page)
+                    # После отправки URL меняется на адрес конкретного чата
+                    slot.project_url = slot.page.url
                     
-                    for idx, share_button in enumerate(images):
-                        filepath = await self._download_generated_image(page, share_button, download_path, idx)
-                        if filepath:
-                            downloaded_files.append(filepath)
-                
-                # Затем проверяем обычные файлы
-                files = await self._check_for_files(page)
-                if files:
-                    logger.info(f"Обнаружено файлов для скачивания: {len(files)}")
-                    download_path = f"./temp_downloads/{username}"
+                    # Проверяем наличие файлов и изображений в ответе
+                    with tracing.span('artifacts'):
+                        artifacts = await self._collect_files(slot.page)
                     
-                    for file_info in files:
-                        filepath = await self._download_file(page, file_info, download_path)
-                        if filepath:
-                            downloaded_files.append(filepath)
-                
-                # Сохранение истории
-                await self._save_conversation(user_project_path, f"[ФОТО] {caption}", response)
-            
-                return response, downloaded_files
-                
-            except Exception as e:
-                logger.error(f"Ошибка при обработке фото (попытка {attempt + 1}/{max_retries}): {e}")
-                
-                # Если браузер упал, перезапускаем его
-                if "Target crashed" in str(e) or "Target closed" in str(e):
-                    logger.warning("Браузер упал, перезапускаем...")
-                    try:
-                        await self.stop()
-                        await asyncio.sleep(2)
-                        await self.start()
-                        logger.info("Браузер перезапущен")
-                        
-                        # Если это не последняя попытка, пробуем снова
-                        if attempt < max_retries - 1:
-                            continue
-                    except Exception as restart_error:
-                        logger.error(f"Ошибка перезапуска браузера: {restart_error}")
-                
-                # Если это последняя попытка или другая ошибка
-                if attempt == max_retries - 1:
-                    return f"Произошла ошибка: {str(e)}", []
+                    return response, artifacts
+                    
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке запроса (попытка {attempt + 1}/{max_retries}): {e}")
+                    
+                    # Если вкладка или браузер упали, восстанавливаем их
+                    if "Target crashed" in str(e) or "Target closed" in str(e):
+                        try:
+                            await self._recover_slot(slot)
+                            
+                            # Если это не последняя попытка, пробуем снова
+                            if attempt < max_retries - 1:
+                                continue
+                        except Exception as restart_error:
+                            logger.error(f"Ошибка перезапуска браузера: {restart_error}")
+                    
+                    # Если это последняя попытка или другая ошибка
+                    if attempt == max_retries - 1:
+                        return IncompleteResponse(f"Произошла ошибка: {str(e)}"), ArtifactBatch()
+        finally:
+            slot.jobs_done += 1
+            await self.pool.release(slot)
         
-        return "Превышено количество попыток", []
+        return IncompleteResponse("Превышено количество попыток"), ArtifactBatch()
     
-    async def create_project_and_send_query(self, username: str, query: str) -> tuple:
+    async def send_photo_query(self, username: str, photo: bytes, caption: str = "", on_text=None,
+                               filename: str = 'photo.jpg') -> tuple:
+        """Отправка фото с текстом в ChatGPT
+        
+        Args:
+            photo: содержимое фото (JPEG)
+            on_text: корутина-функция (offset, text), получающая изменения ответа по мере генерации
+            filename: имя файла, под которым фото загружается в ChatGPT
+        
+        Returns:
+            tuple: (response_text, ArtifactBatch со скачанными файлами)
+        """
+        response, artifacts = await self._run_job(
+            username, "фото",
+            lambda page: self._send_photo_and_get_response(page, photo, filename, caption, on_text)
+        )
+        
+        # Сохранение истории
+        self._save_conversation(username, 'photo', caption, response)
+        return response, artifacts
+    
+    async def create_project_and_send_query(self, username: str, query: str, on_text=None) -> tuple:
         """Создание проекта для пользователя и отправка запроса в ChatGPT
         
+        Args:
+            on_text: корутина-функция (offset, text), получающая изменения ответа по мере генерации
+        
         Returns:
-            tuple: (response_text, list_of_downloaded_files)
+            tuple: (response_text, ArtifactBatch со скачанными файлами)
         """
-        max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                # Создание директории проекта пользователя
-                user_project_path = Path(f"./user_projects/{username}")
-                user_project_path.mkdir(parents=True, exist_ok=True)
-                
-                # Используем существующую страницу
-                pages = self.browser.pages
-                if pages:
-                    page: Page = pages[0]
-                else:
-                    page: Page = await self.browser.new_page()
-                    await page.goto('https://chatgpt.com/', wait_until='domcontentloaded', timeout=60000)
-                    await asyncio.sleep(3)
-                
-                logger.info(f"Обработка запроса от {username}")
-                
-                # Обновление страницы только при первом запросе
-                if self.first_request:
-                    logger.info("Ожидание 5 секунд перед обновлением...")
-                    await asyncio.sleep(5)
-                    logger.info("Обновление страницы (F5)...")
-                    await page.keyboard.press('F5')
-                    logger.info("Ожидание полной загрузки страницы...")
-                    
-                    # Ждем исчезновения спиннера или появления поля ввода
-                    for i in range(15):
-                        await asyncio.sleep(1)
-                        # Проверяем есть ли поле ввода
-                        input_check = await page.query_selector('textarea, div[contenteditable="true"]')
-                        if input_check:
-                            logger.info(f"Страница загружена через {i+1} сек")
-                            break
-                        if i % 3 == 0:
-                            logger.info(f"Ожидание загрузки... ({i+1} сек)")
-                    
-                    await self._save_debug_snapshot(page, "После обновления F5 (текст)")
-                    self.first_request = False
-                
-                # Проверка и создание/открытие проекта (только если не в чате)
-                project_exists = await self._check_and_open_project(page, username)
-                await self._save_debug_snapshot(page, "После проверки проекта (текст)")
-                
-                if not project_exists:
-                    # Создание нового проекта только если его нет
-                    logger.info(f"Создаем новый проект для {username}")
-                    await self._create_new_project(page, username)
-                    await self._save_debug_snapshot(page, "После создания проекта")
-                else:
-                    logger.info(f"Используем существующий чат для {username}")
-                
-                # Отправка запроса
-                response = await self._send_query_and_get_response(page, query)
-                
-                # Проверяем наличие файлов и изображений в ответе
-                downloaded_files = []
-                
-                # Сначала проверяем сгенерированные изображения
-                images = await self._check_for_generated_images(page, log=True)
-                if images:
-                    download_path = f"./temp_downloads/{username}"
-                    
-                    for idx, share_button in enumerate(images):
-                        filepath = await self._download_generated_image(page, share_button, download_path, idx)
-                        if filepath:
-                            downloaded_files.append(filepath)
-                
-                # Затем проверяем обычные файлы
-                files = await self._check_for_files(page)
-                if files:
-                    logger.info(f"Обнаружено файлов для скачивания: {len(files)}")
-                    download_path = f"./temp_downloads/{username}"
-                    
-                    for file_info in files:
-                        filepath = await self._download_file(page, file_info, download_path)
-                        if filepath:
-                            downloaded_files.append(filepath)
-                
-                # Сохранение истории
-                await self._save_conversation(user_project_path, query, response)
-            
-                return response, downloaded_files
-                
-            except Exception as e:
-                logger.error(f"Ошибка при обработке запроса (попытка {attempt + 1}/{max_retries}): {e}")
-                
-                # Если браузер упал, перезапускаем его
-                if "Target crashed" in str(e) or "Target closed" in str(e):
-                    logger.warning("Браузер упал, перезапускаем...")
-                    try:
-                        await self.stop()
-                        await asyncio.sleep(2)
-                        await self.start()
-                        logger.info("Браузер перезапущен")
-                        
-                        # Если это не последняя попытка, пробуем снова
-                        if attempt < max_retries - 1:
-                            continue
-                    except Exception as restart_error:
-                        logger.error(f"Ошибка перезапуска браузера: {restart_error}")
-                
-                # Если это последняя попытка или другая ошибка
-                if attempt == max_retries - 1:
-                    return f"Произошла ошибка: {str(e)}", []
+        response, artifacts = await self._run_job(
+            username, "текст",
+            lambda page: self._send_query_and_get_response(page, query, on_text)
+        )
         
-        return "Превышено количество попыток", []
+        # Сохранение истории
+        self._save_conversation(username, 'text', query, response)
+        return response, artifacts
+    
     async def _check_and_solve_captcha(self, page: Page):
         """Проверка и автоматическое прохождение капчи"""
         try:
             logger.info("Ожидание загрузки капчи...")
             
-            # Ждем появления текста капчи (до 5 секунд)
-            captcha_text_found = False
-            for i in range(5):
-                await asyncio.sleep(1)
-                captcha_text_found = await page.query_selector('text=Подтвердите, что вы человек')
-                if captcha_text_found:
-                    logger.info(f"Капча появилась через {i+1} сек")
-                    break
+            # Если капча уже на странице - сразу к ней, если загрузился чат - капчи нет,
+            # иначе ждем появления текста капчи (до 5 секунд)
+            captcha_text_found = await page.query_selector(waits.CAPTCHA_SELECTOR)
+            if not captcha_text_found and not await page.query_selector(waits.INPUT_SELECTOR):
+                captcha_text_found = await waits.wait_for_selector(page, waits.CAPTCHA_SELECTOR, timeout=5)
             
             if not captcha_text_found:
                 logger.info("Капча не найдена - страница загружена без проверки")
@@ -341,31 +772,28 @@ class BrowserManager:
             checkbox = None
             checkbox_frame = page
             
-            # Пробуем найти чекбокс в течение 10 секунд
-            for attempt in range(10):
-                await asyncio.sleep(1)
+            async def find_checkbox():
+                nonlocal checkbox, checkbox_frame
                 
                 # Способ 1: прямой поиск
                 checkbox = await page.query_selector('input[type="checkbox"]')
-                
-                # Способ 2: через iframe (Cloudflare использует iframe)
-                if not checkbox:
-                    frames = page.frames
-                    for frame in frames:
-                        try:
-                            checkbox = await frame.query_selector('input[type="checkbox"]')
-                            if checkbox:
-                                logger.info(f"Чекбокс найден во фрейме через {attempt+1} сек")
-                                checkbox_frame = frame
-                                break
-                        except:
-                            continue
-                
                 if checkbox:
-                    break
+                    return True
                 
-                if attempt % 3 == 0:
-                    logger.info(f"Ожидание чекбокса... ({attempt+1} сек)")
+                # Способ 2: через iframe (Cloudflare использует iframe)
+                for frame in page.frames:
+                    try:
+                        checkbox = await frame.query_selector('input[type="checkbox"]')
+                        if checkbox:
+                            logger.info("Чекбокс найден во фрейме")
+                            checkbox_frame = frame
+                            return True
+                    except:
+                        continue
+                return False
+            
+            # Пробуем найти чекбокс в течение 10 секунд
+            await waits.wait_until(find_checkbox, timeout=10, interval=0.5, description="чекбокс капчи")
             
             if checkbox:
                 logger.info("Чекбокс загружен! Выполняю клик с эмуляцией курсора...")
@@ -403,13 +831,9 @@ class BrowserManager:
                     await checkbox_frame.mouse.click(final_x, final_y)
                     logger.info("✓ Клик по капче выполнен!")
                     
-                    # Ждем обработки капчи
+                    # Ждем обработки капчи: текст проверки должен исчезнуть
                     logger.info("Ожидание проверки Cloudflare...")
-                    await asyncio.sleep(8)
-                    
-                    # Проверяем исчезла ли капча
-                    captcha_still_there = await page.query_selector('text=Подтвердите, что вы человек')
-                    if not captcha_still_there:
+                    if await waits.wait_for_selector(page, waits.CAPTCHA_SELECTOR, timeout=15, state='hidden'):
                         logger.info("✓ Капча успешно пройдена!")
                     else:
                         logger.warning("⚠ Капча все еще отображается, возможно требуется ручное вмешательство")
@@ -422,41 +846,47 @@ class BrowserManager:
             logger.error(f"Ошибка при проверке капчи: {e}", exc_info=True)
             # Продолжаем работу даже если не удалось обработать капчу
     
-    async def _check_and_open_project(self, page: Page, username: str) -> bool:
-        """Проверка существования и открытие проекта пользователя"""
+    async def _check_and_open_project(self, slot: PageSlot, username: str) -> bool:
+        """Проверка существования и открытие проекта пользователя во вкладке"""
         try:
-            logger.info(f"Проверка проекта для {username}...")
+            logger.info(f"Проверка проекта для {username} (вкладка #{slot.index})...")
+            page = slot.page
             
             # Проверяем находимся ли мы уже в нужном проекте
             # Смотрим на URL - если там есть /g/ значит мы в чате
             current_url = page.url
             
-            # Если уже в чате - проверяем что это чат ЭТОГО пользователя
+            # Если уже в чате - проверяем что это чат ЭТОГО пользователя.
+            # Владелец вкладки меняется только после успешного открытия проекта (_prepare_page),
+            # поэтому неудачное переключение не оставляет вкладку "чужому" пользователю
             if '/g/' in current_url or '/c/' in current_url:
-                # Проверяем совпадает ли текущий пользователь с тем, кто был до этого
-                if self.current_user_id == username:
+                if slot.current_user_id == username:
                     logger.info(f"Уже находимся в чате пользователя {username}, продолжаем использовать его")
                     return True
-                else:
-                    logger.info(f"Смена пользователя: {self.current_user_id} -> {username}. Переключаемся на новый чат...")
-                    # Обновляем текущего пользователя
-                    self.current_user_id = username
-                    # НЕ возвращаем True, чтобы создать/открыть проект для нового пользователя
-            else:
-                # Если не в чате, обновляем текущего пользователя
-                self.current_user_id = username
+                logger.info(f"Смена пользователя во вкладке #{slot.index}: {slot.current_user_id} -> {username}. Переключаемся на новый чат...")
             
-            # Ищем проект с именем пользователя в списке проектов
-            await asyncio.sleep(2)
+            # Вкладка больше не принадлежит предыдущему пользователю
+            slot.current_user_id = None
+            slot.project_url = None
+            
+            # Известный проект открываем прямым переходом по адресу
+            project_url = self.projects.get(username)
+            if project_url and await self._open_indexed_project(page, username, project_url):
+                return True
+            
+            # Ищем проект с именем пользователя в списке проектов (ждем отрисовки боковой панели)
+            await waits.wait_for_sidebar(page, timeout=5)
             
             # Пытаемся найти текст с именем пользователя в проектах
             project_elements = await page.query_selector_all('text=' + username)
             
             if project_elements:
                 logger.info(f"Найден существующий проект для {username}, открываем...")
-                # Кликаем на проект
+                # Кликаем на проект и ждем открытия его страницы
+                previous_url = page.url
                 await project_elements[0].click()
-                await asyncio.sleep(3)
+                if await waits.wait_for_project_page(page, previous_url, timeout=10):
+                    await self.projects.set(username, page.url)
                 return True
             
             logger.info(f"Проект для {username} не найден, нужно создать")
@@ -466,8 +896,26 @@ class BrowserManager:
             logger.error(f"Ошибка проверки проекта: {e}")
             return False
     
-    async def _create_new_project(self, page: Page, username: str):
-        """Создание нового проекта в ChatGPT"""
+    async def _open_indexed_project(self, page: Page, username: str, project_url: str) -> bool:
+        """Открытие проекта по адресу из индекса с проверкой, что он еще существует"""
+        logger.info(f"Открываем проект {username} по адресу из индекса: {project_url}")
+        try:
+            await page.goto(project_url, wait_until='domcontentloaded', timeout=60000)
+            # Удаленный проект открывается редиректом на главную или страницей ошибки
+            if project_url_from(page.url) == project_url and await waits.wait_for_input_ready(page, timeout=10):
+                return True
+            logger.warning(f"Проект {username} не открылся по адресу из индекса (текущий URL: {page.url})")
+        except Exception as e:
+            logger.warning(f"Ошибка перехода к проекту {username}: {e}")
+        await self.projects.forget(username)
+        return False
+    
+    async def _create_new_project(self, page: Page, username: str) -> bool:
+        """Создание нового проекта в ChatGPT
+        
+        Returns:
+            bool: True - проект создан и открыт во вкладке
+        """
         try:
             logger.info(f"Создание нового проекта для {username}...")
             
@@ -479,39 +927,28 @@ class BrowserManager:
                 'div:has-text("Новый проект")'
             ]
             
-            new_project_button = None
-            for selector in new_project_selectors:
-                try:
-                    logger.info(f"Ищу кнопку создания проекта: `{selector}`")
-                    new_project_button = await page.wait_for_selector(selector, timeout=5000)
-                    if new_project_button:
-                        logger.info("Кнопка 'Новый проект' найдена")
-                        break
-                except:
-                    continue
+            logger.info("Ищу кнопку создания проекта...")
+            new_project_button = await selector_registry.query(page, 'new_project', new_project_selectors, timeout=5)
+            if new_project_button:
+                logger.info("Кнопка 'Новый проект' найдена")
             
             if not new_project_button:
                 logger.warning("Кнопка 'Новый проект' не найдена, обновляю страницу...")
-                await page.keyboard.press('F5')
-                await asyncio.sleep(3)
+                await page.reload(wait_until='domcontentloaded', timeout=60000)
+                await waits.wait_for_sidebar(page, timeout=10)
                 
                 # Повторная попытка после обновления
-                for selector in new_project_selectors:
-                    try:
-                        new_project_button = await page.wait_for_selector(selector, timeout=5000)
-                        if new_project_button:
-                            logger.info("Кнопка 'Новый проект' найдена после обновления")
-                            break
-                    except:
-                        continue
+                new_project_button = await selector_registry.query(page, 'new_project', new_project_selectors, timeout=5)
+                if new_project_button:
+                    logger.info("Кнопка 'Новый проект' найдена после обновления")
                 
                 if not new_project_button:
-                    logger.warning("Кнопка 'Новый проект' не найдена даже после обновления, продолжаем без создания проекта")
-                    return
+                    logger.warning("Кнопка 'Новый проект' не найдена даже после обновления")
+                    return False
             
-            # Кликаем на кнопку
+            # Кликаем на кнопку и ждем окно создания проекта
             await new_project_button.click()
-            await asyncio.sleep(2)
+            await waits.wait_for_dialog(page, timeout=5)
             
             # Ищем поле ввода имени проекта
             name_input_selectors = [
@@ -521,20 +958,14 @@ class BrowserManager:
                 'input'
             ]
             
-            name_input = None
-            for selector in name_input_selectors:
-                try:
-                    name_input = await page.wait_for_selector(selector, timeout=3000)
-                    if name_input:
-                        logger.info(f"Поле ввода имени найдено: `{selector}`")
-                        break
-                except:
-                    continue
+            name_input = await selector_registry.query(page, 'project_name_input', name_input_selectors, timeout=3)
+            if name_input:
+                logger.info("Поле ввода имени найдено")
             
             if name_input:
                 # Вводим имя пользователя как название проекта
                 await name_input.fill(username)
-                await asyncio.sleep(1)
+                previous_url = page.url
                 
                 # Ищем кнопку подтверждения (Создать/Create/OK)
                 confirm_selectors = [
@@ -550,27 +981,28 @@ class BrowserManager:
                         if confirm_button:
                             await confirm_button.click()
                             logger.info(f"Проект '{username}' создан")
-                            await asyncio.sleep(2)
+                            # Ждем перехода на страницу нового проекта
+                            await waits.wait_for_project_page(page, previous_url, timeout=10)
                             break
                     except:
                         continue
+                if project_url_from(page.url):
+                    return True
+                logger.warning(f"Страница нового проекта не открылась: {page.url}")
             else:
                 logger.warning("Поле ввода имени проекта не найдено")
+            return False
                 
         except Exception as e:
             logger.error(f"Ошибка создания проекта: {e}")
-            # Продолжаем работу даже если не удалось создать проект
+            return False
     
 
     async def _check_for_generated_images(self, page: Page, log: bool = False) -> list:
         """Проверка наличия сгенерированных изображений в ответе ChatGPT"""
         try:
-            # Ищем кнопки "Поделиться" для изображений
-            share_buttons = await page.query_selector_all('button[aria-label*="Поделиться этим изображением"]')
-            
-            if not share_buttons:
-                # Пробуем альтернативные селекторы
-                share_buttons = await page.query_selector_all('button[aria-label*="Share this image"]')
+            # Ищем кнопки "Поделиться" для изображений (русский и английский интерфейс одним запросом)
+            share_buttons = await page.query_selector_all(IMAGE_BUTTON_SELECTOR)
             
             # Логируем только если запрошено
             if log and len(share_buttons) > 0:
@@ -619,18 +1051,35 @@ class BrowserManager:
             logger.error(f"Ошибка проверки файлов: {e}")
             return []
     
-    async def _download_generated_image(self, page: Page, share_button, download_path: str, index: int = 0) -> str:
-        """Скачивание сгенерированного изображения через кнопку 'Поделиться'"""
+    async def _resolve_answer_files(self, page: Page):
+        """Ссылки на файлы, отмеченные при разборе последнего ответа (None - разбора не было)"""
+        descriptors = self._answer_files.pop(page, None)
+        if descriptors is None:
+            return None
+        files = []
+        for descriptor in descriptors:
+            element = await page.query_selector(f'[data-tg-artifact="{descriptor["index"]}"]')
+            if element:
+                files.append({'element': element, 'href': descriptor['href'], 'name': descriptor['name'] or 'file'})
+                logger.info(f"Найден файл: {descriptor['name'] or descriptor['href']}")
+        if descriptors and not files:
+            # Отмеченные ссылки пропали (ответ перерисован) - ищем файлы по всей странице
+            return None
+        return files
+    
+    async def _start_image_download(self, page: Page, share_button, index: int = 0):
+        """Запуск скачивания сгенерированного изображения через кнопку 'Поделиться'
+        
+        Returns:
+            Download: начатая загрузка (сохраняется через _save_download) или None
+        """
         try:
             logger.info(f"Скачивание изображения #{index + 1}...")
             
-            # Создаем директорию для загрузок
-            os.makedirs(download_path, exist_ok=True)
-            
             # Нажимаем кнопку "Поделиться"
             logger.info("Нажатие кнопки 'Поделиться'...")
             await share_button.click()
-            await asyncio.sleep(2)
+            await waits.wait_for_dialog(page, timeout=5)
             
             # Ищем кнопку "Скачать" в появившемся окне
             download_button = None
@@ -640,15 +1089,10 @@ class BrowserManager:
                 'div.flex.items-center.justify-center svg[viewBox="0 0 20 20"]',  # SVG иконка скачивания
             ]
             
-            for selector in download_selectors:
-                try:
-                    # Ждем появления кнопки скачивания
-                    download_button = await page.wait_for_selector(selector, timeout=5000, state='visible')
-                    if download_button:
-                        logger.info(f"Найдена кнопка скачивания: {selector}")
-                        break
-                except:
-                    continue
+            # Ждем появления кнопки скачивания (все варианты сразу)
+            download_button = await selector_registry.query(page, 'download_button', download_selectors, timeout=5)
+            if download_button:
+                logger.info("Найдена кнопка скачивания")
             
             if not download_button:
                 # Пробуем найти по структуре (div с иконкой скачивания)
@@ -681,20 +1125,11 @@ class BrowserManager:
                 
                 download = await download_info.value
                 
-                # Получаем имя файла
-                filename = download.suggested_filename or f'generated_image_{index + 1}.png'
-                filepath = os.path.join(download_path, filename)
-                
-                # Сохраняем файл
-                logger.info(f"Сохранение файла: {filepath}")
-                await download.save_as(filepath)
-                logger.info(f"✓ Изображение успешно скачано: {filepath}")
-                
-                # Закрываем окно "Поделиться"
+                # Закрываем окно "Поделиться": файл докачивается уже без него
                 await page.keyboard.press('Escape')
-                await asyncio.sleep(1)
+                await waits.wait_for_dialog(page, timeout=3, hidden=True)
                 
-                return filepath
+                return download
                 
             except asyncio.TimeoutError:
                 logger.error("Таймаут при ожидании скачивания изображения (3 минуты)")
@@ -710,48 +1145,25 @@ class BrowserManager:
                 pass
             return None
     
-    async def _download_file(self, page: Page, file_info: dict, download_path: str) -> str:
-        """Скачивание файла из ChatGPT"""
+    async def _download_file(self, page: Page, file_info: dict, batch: ArtifactBatch):
+        """Скачивание файла из ChatGPT в batch"""
         try:
             logger.info(f"Скачивание файла: {file_info['name']}")
             
-            # Создаем директорию для загрузок
-            os.makedirs(download_path, exist_ok=True)
-            
             # Если это blob URL, скачиваем через JavaScript
             if 'blob:' in file_info['href']:
                 logger.info("Скачивание blob файла через JavaScript...")
                 
-                # Получаем содержимое blob через JavaScript
-                content = await page.evaluate('''
-                    async (url) => {
-                        const response = await fetch(url);
-                        const blob = await response.blob();
-                        const reader = new FileReader();
-                        return new Promise((resolve) => {
-                            reader.onloadend = () => resolve(reader.result);
-                            reader.readAsDataURL(blob);
-                        });
-                    }
-                ''', file_info['href'])
-                
-                # Декодируем base64
-                import base64
-                if content.startswith('data:'):
-                    # Убираем префикс data:mime/type;base64,
-                    content = content.split(',', 1)[1]
-                
-                file_data = base64.b64decode(content)
-                
-                # Сохраняем файл
                 filename = file_info['name'] if file_info['name'] != 'file' else 'downloaded_file.txt'
-                filepath = os.path.join(download_path, filename)
-                
-                with open(filepath, 'wb') as f:
-                    f.write(file_data)
+                artifact = batch.new(filename)
+                try:
+                    await self._save_blob(page, file_info['href'], artifact)
+                except BaseException:
+                    batch.discard(artifact)
+                    raise
+                batch.add(artifact)
                 
-                logger.info(f"Blob файл сохранен: {filepath}")
-                return filepath
+                logger.info(f"Blob файл сохранен: {artifact.name}")
             
             else:
                 # Обычное скачивание через expect_download
@@ -763,15 +1175,9 @@ class BrowserManager:
                 
                 download = await download_info.value
                 
-                # Получаем имя файла
-                filename = download.suggested_filename or file_info['name']
-                filepath = os.path.join(download_path, filename)
-                
-                # Сохраняем файл
-                await download.save_as(filepath)
-                logger.info(f"Файл сохранен: {filepath}")
-                
-                return filepath
+                # Получаем имя файла и сохраняем файл
+                artifact = batch.new(download.suggested_filename or file_info['name'])
+                await self._save_download(download, artifact, batch)
                 
         except Exception as e:
             logger.error(f"Ошибка скачивания файла: {e}", exc_info=True)
@@ -790,26 +1196,256 @@ class BrowserManager:
                     
                     if code_content and len(code_content) > 10:
                         filename = file_info['name'] if file_info['name'] != 'file' else 'code_file.txt'
-                        filepath = os.path.join(download_path, filename)
-                        
-                        with open(filepath, 'w', encoding='utf-8') as f:
-                            f.write(code_content)
+                        artifact = batch.new(filename)
+                        await artifact.write(code_content.encode('utf-8'))
+                        batch.add(artifact)
                         
-                        logger.info(f"Файл сохранен альтернативным методом: {filepath}")
-                        return filepath
+                        logger.info(f"Файл сохранен альтернативным методом: {artifact.name}")
                         
             except Exception as alt_error:
                 logger.error(f"Альтернативный метод тоже не сработал: {alt_error}")
-            
-            return None
 
-    async def _send_query_and_get_response(self, page: Page, query: str) -> str:
+    async def _save_blob(self, page: Page, url: str, artifact: Artifact):
+        """Скачивание blob-файла со страницы частями по BLOB_CHUNK_SIZE байт
+        
+        Blob остается на странице, в Python передается по одному фрагменту за раз,
+        поэтому расход памяти не зависит от размера файла.
+        """
+        blob_id, size = await page.evaluate(BLOB_OPEN_JS, url)
+        try:
+            for start in range(0, size, BLOB_CHUNK_SIZE):
+                chunk = await page.evaluate(BLOB_READ_JS, {
+                    'id': blob_id, 'start': start, 'end': min(start + BLOB_CHUNK_SIZE, size),
+                })
+                await artifact.write_base64(chunk)
+        finally:
+            try:
+                await page.evaluate(BLOB_CLOSE_JS, blob_id)
+            except Exception:
+                pass
+        logger.info(f"Blob скачан частями: {size} байт")
+    
+    async def _count_assistant_messages(self, page: Page) -> int:
+        """Количество ответов ChatGPT на странице"""
+        return await page.evaluate(
+            '(selector) => document.querySelectorAll(selector).length', RESPONSE_SELECTOR
+        )
+    
+    async def _wait_for_generation_end(self, page: Page, baseline: int, timeout: float) -> bool:
+        """Ожидание окончания генерации по событиям страницы (MutationObserver)
+        
+        Returns:
+            bool: True - генерация завершена, False - вышел таймаут
+        
+        Raises:
+            GenerationError: вместо ответа появилась ошибка генерации
+        """
+        # Промис в странице разрешается в момент окончания генерации,
+        # а Python-future - сразу вслед за ним, без периодического опроса
+        done = asyncio.ensure_future(page.evaluate(GENERATION_DONE_JS, {
+            'selector': RESPONSE_SELECTOR,
+            'userSelector': QUERY_SELECTOR,
+            'streamingSelector': STREAMING_SELECTOR,
+            'imageSelector': IMAGE_BUTTON_SELECTOR,
+            'errorSelector': ERROR_SELECTOR,
+            'baseline': baseline,
+            'quietMs': 300,
+            'idleMs': 3000,
+        }))
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                finished, _ = await asyncio.wait({done}, timeout=min(10, remaining))
+                if finished:
+                    result = done.result()
+                    if isinstance(result, dict) and result.get('error'):
+                        raise GenerationError(result['error'])
+                    return True
+                logger.info("Генерация продолжается...")
+        finally:
+            if not done.done():
+                done.cancel()
+    
+    async def _probe_page(self, page: Page, baseline: int) -> dict:
+        """Состояние генерации одним вызовом в странице
+        
+        Returns:
+            dict: {'count', 'length', 'hash', 'images', 'streaming', 'error'}
+        """
+        return await page.evaluate(PROBE_JS, {
+            'selector': RESPONSE_SELECTOR,
+            'userSelector': QUERY_SELECTOR,
+            'baseline': baseline,
+            'streamingSelector': STREAMING_SELECTOR,
+            'imageSelector': IMAGE_BUTTON_SELECTOR,
+            'errorSelector': ERROR_SELECTOR,
+        })
+    
+    async def _poll_for_generation_end(self, page: Page, baseline: int, timeout: float) -> bool:
+        """Резервное ожидание: последний ответ не меняется несколько секунд подряд и индикатор генерации исчез
+        
+        Raises:
+            GenerationError: на странице появилась ошибка генерации (текст ошибки - в исключении)
+        """
+        previous = None
+        stable_count = 0
+        for i in range(int(timeout)):
+            await asyncio.sleep(1)
+            probe = await self._probe_page(page, baseline)
+            if probe['error']:
+                # Генерация прервана ошибкой - дальше ждать нечего
+                raise GenerationError(probe['error'])
+            if probe['count'] <= baseline:
+                continue
+            current = (probe['length'], probe['hash'])
+            if current == previous and not probe['streaming']:
+                stable_count += 1
+                if stable_count >= 3:
+                    return True
+            else:
+                stable_count = 0
+            previous = current
+            if i and i % 10 == 0:
+                logger.info(f"Генерация продолжается... ({probe['length']} символов, изображений: {probe['images']})")
+        return False
+    
+    async def _extract_answer(self, page: Page, baseline: int):
+        """Текст, Markdown и вложения нового ответа за один вызов в странице
+        
+        Returns:
+            dict: {'text', 'markdown', 'artifacts'} или None, если нового ответа нет
+                или разобрать его не удалось
+        """
+        try:
+            with tracing.span('extract'):
+                answer = await page.evaluate(EXTRACT_ANSWER_JS, {'selector': RESPONSE_SELECTOR, 'baseline': baseline})
+        except Exception as e:
+            logger.warning(f"Не удалось разобрать ответ в странице: {e}")
+            return None
+        if answer is not None:
+            self._answer_files[page] = [a for a in answer['artifacts'] if a['kind'] == 'file']
+        return answer
+    
+    def _on_stream_push(self, page: Page, data: dict):
+        """Прием фрагмента стримящегося ответа из страницы"""
+        queue = self._stream_queues.get(page)
+        if queue is not None:
+            queue.put_nowait((data['offset'], data['text']))
+    
+    async def _iter_response_deltas(self, page: Page, baseline: int):
+        """Асинхронный генератор фрагментов нового ответа по мере генерации
+        
+        Yields:
+            tuple: (offset, text) - текст ответа, начиная с позиции offset, изменился на text
+        """
+        queue = asyncio.Queue()
+        self._stream_queues[page] = queue
+        try:
+            await page.evaluate(STREAM_START_JS, {
+                'selector': RESPONSE_SELECTOR,
+                'baseline': baseline,
+                'throttleMs': 150,
+            })
+            while True:
+                yield await queue.get()
+        finally:
+            self._stream_queues.pop(page, None)
+            try:
+                await page.evaluate(STREAM_STOP_JS)
+            except Exception:
+                pass
+    
+    async def _stream_response(self, page: Page, baseline: int, on_text):
+        """Передача изменений ответа в on_text по мере генерации: текст с позиции offset заменен на text"""
+        async for offset, chunk in self._iter_response_deltas(page, baseline):
+            try:
+                await on_text(offset, chunk)
+            except Exception as e:
+                logger.debug(f"Ошибка обработчика стриминга: {e}")
+    
+    async def _wait_for_response(self, page: Page, baseline: int, check_files: bool = False, on_text=None) -> str:
+        """Ожидание нового ответа ChatGPT и получение его текста
+        
+        Args:
+            baseline: количество ответов на странице до отправки запроса
+            check_files: дописать в ответ количество найденных файлов, если вышел таймаут
+            on_text: корутина-функция (offset, text), получающая изменения ответа по мере генерации
+        """
+        logger.info("Ожидание ответа от ChatGPT...")
+        started = asyncio.get_running_loop().time()
+        
+        stream_task = asyncio.create_task(self._stream_response(page, baseline, on_text)) if on_text else None
+        try:
+            try:
+                with tracing.span('generation'):
+                    finished = await self._wait_for_generation_end(page, baseline, GENERATION_TIMEOUT)
+            except GenerationError:
+                raise
+            except Exception as e:
+                # Контекст страницы мог пересоздаться (навигация) - переходим на опрос
+                logger.warning(f"Наблюдение за генерацией прервано ({e}), переходим на опрос страницы")
+                elapsed = asyncio.get_running_loop().time() - started
+                finished = await self._poll_for_generation_end(page, baseline, max(1, GENERATION_TIMEOUT - elapsed))
+        except GenerationError as e:
+            logger.warning(f"ChatGPT сообщил об ошибке: {e}")
+            return IncompleteResponse(f"Ошибка ChatGPT: {e}")
+        finally:
+            if stream_task:
+                stream_task.cancel()
+                await asyncio.gather(stream_task, return_exceptions=True)
+        
+        self._answer_files.pop(page, None)
+        answer = await self._extract_answer(page, baseline)
+        if answer is not None:
+            response_text = answer['text']
+        else:
+            responses = await page.query_selector_all(RESPONSE_SELECTOR)
+            response_text = await responses[-1].inner_text() if len(responses) > baseline else ""
+        
+        # Проверяем наличие изображений (кнопки "Поделиться")
+        images = await self._check_for_generated_images(page)
+        
+        if finished:
+            if images:
+                logger.info(f"✓ Генерация изображения завершена. Текст: {len(response_text)} символов")
+                if not response_text:
+                    return "Изображение создано"
+            else:
+                logger.info(f"✓ Генерация завершена за {asyncio.get_running_loop().time() - started:.1f} сек. Длина ответа: {len(response_text)}")
+            if answer is not None and answer['markdown']:
+                return FormattedResponse(response_text, answer['markdown'])
+            return response_text
+        
+        # Если вышли по таймауту, возвращаем что есть
+        if images:
+            logger.info("Таймаут, но изображение сгенерировано")
+            return IncompleteResponse(response_text if response_text else "Изображение создано")
+        
+        if len(response_text) > 10:
+            logger.info(f"Таймаут, но есть ответ: {len(response_text)} символов")
+            if check_files:
+                # Проверяем наличие файлов
+                files = self._answer_files.get(page)
+                if files is None:
+                    files = await self._check_for_files(page)
+                if files:
+                    response_text += f"\n\n📎 Обнаружено файлов: {len(files)}"
+            return IncompleteResponse(response_text)
+        
+        return IncompleteResponse("Не удалось получить ответ от ChatGPT (таймаут)")
+    
+    async def _send_query_and_get_response(self, page: Page, query: str, on_text=None) -> str:
         """Отправка запроса и получение ответа"""
         try:
             logger.info("Поиск поля ввода...")
             
             # Ждем загрузки страницы
-            await asyncio.sleep(3)
+            await waits.wait_for_input_ready(page, timeout=10)
             await self._save_debug_snapshot(page, "Перед поиском поля ввода")
             
             query_to_send = query
@@ -825,29 +1461,17 @@ class BrowserManager:
                 'textarea'
             ]
             
-            input_selector_found = None
-            for selector in input_selectors:
-                try:
-                    logger.info(f"Пробую селектор: `{selector}`")
-                    await page.wait_for_selector(selector, timeout=10000, state='visible')
-                    # Проверяем что элемент действительно есть и видим
-                    test_element = await page.query_selector(selector)
-                    if test_element:
-                        is_visible = await test_element.is_visible()
-                        if is_visible:
-                            input_selector_found = selector
-                            logger.info(f"Найден видимый элемент ввода: `{selector}`")
-                            break
-                except Exception as e:
-                    logger.debug(f"Селектор `{selector}` не подошел: {e}")
-                    continue
+            # Все варианты ждем одновременно, запомненный ранее проверяется первым
+            input_selector_found = await selector_registry.resolve(page, 'prompt_input', input_selectors, timeout=10)
+            if input_selector_found:
+                logger.info(f"Найден видимый элемент ввода: `{input_selector_found}`")
             
             if not input_selector_found:
                 logger.error("Не найдено поле ввода")
                 
                 # Сохраняем скриншот для отладки
                 try:
-                    os.makedirs('./debug', exist_ok=True)
+                    await file_ops.makedirs('./debug')
                     
                     screenshot_path = f"./debug/screenshot.png"
                     await page.screenshot(path=screenshot_path, full_page=True)
@@ -855,14 +1479,11 @@ class BrowserManager:
                     
                     # Сохраняем HTML для анализа
                     html_content = await page.content()
-                    with open('./debug/page.html', 'w', encoding='utf-8') as f:
-                        f.write(html_content)
+                    await file_ops.write_text('./debug/page.html', html_content)
                     logger.info("HTML страницы сохранен: ./debug/page.html")
                     
                     # Сохраняем URL
-                    with open('./debug/info.txt', 'w', encoding='utf-8') as f:
-                        f.write(f"URL: {page.url}\n")
-                        f.write(f"Title: {await page.title()}\n")
+                    await file_ops.write_text('./debug/info.txt', f"URL: {page.url}\nTitle: {await page.title()}\n")
                     logger.info("Информация сохранена: ./debug/info.txt")
                 except Exception as e:
                     logger.error(f"Ошибка сохранения отладочной информации: {e}")
@@ -872,101 +1493,33 @@ class BrowserManager:
                 logger.error(f"Текущий URL: {current_url}")
                 
                 if 'auth' in current_url or 'login' in current_url:
-                    return "Ошибка: требуется авторизация в ChatGPT. Профиль не авторизован."
+                    return IncompleteResponse("Ошибка: требуется авторизация в ChatGPT. Профиль не авторизован.")
                 
-                return "Ошибка: не найдено поле ввода. Проверьте debug_screenshot.png и debug_page.html"
+                return IncompleteResponse("Ошибка: не найдено поле ввода. Проверьте debug_screenshot.png и debug_page.html")
             
-            # Клик по полю (используем селектор, а не сохраненный элемент)
-            await page.click(input_selector_found)
-            await asyncio.sleep(0.5)
+            with tracing.span('input_fill'):
+                # Клик по полю (используем селектор, а не сохраненный элемент)
+                await page.click(input_selector_found)
+                
+                # Вводим текст (зашифрованный или обычный) и ждем активации кнопки отправки
+                await page.fill(input_selector_found, query_to_send)
+                await waits.wait_for_send_ready(page, timeout=3)
             
-            # Вводим текст (зашифрованный или обычный)
-            await page.fill(input_selector_found, query_to_send)
-            await asyncio.sleep(0.5)
+            # Запоминаем количество ответов до отправки, чтобы дождаться именно нового
+            baseline = await self._count_assistant_messages(page)
             
             logger.info("Отправка запроса...")
             # Отправка (Enter)
             await page.keyboard.press('Enter')
             
-            # Ожидание начала генерации
-            await asyncio.sleep(3)
-            
-            # Поиск ответа
-            response_selector = 'div[data-message-author-role="assistant"]'
-            
-            logger.info("Ожидание ответа от ChatGPT...")
-            
-            previous_length = 0
-            stable_count = 0
-            has_images = False
-            
-            # Ждем появления и завершения генерации ответа
-            for i in range(120):
-                await asyncio.sleep(1)
-                
-                # Проверяем наличие изображений (кнопки "Поделиться")
-                images = await self._check_for_generated_images(page)
-                if images and not has_images:
-                    logger.info(f"✓ Обнаружена генерация изображения!")
-                    has_images = True
-                
-                responses = await page.query_selector_all(response_selector)
-                if responses:
-                    last_response = responses[-1]
-                    response_text = await last_response.inner_text()
-                    current_length = len(response_text)
-                    
-                    # Если есть изображение и текст не растёт - генерация завершена
-                    if has_images and current_length == previous_length:
-                        stable_count += 1
-                        if stable_count >= 5:
-                            logger.info(f"✓ Генерация изображения завершена. Текст: {current_length} символов")
-                            return response_text if current_length > 0 else "Изображение создано"
-                    # Если только текст без изображений
-                    elif current_length > 10 and current_length == previous_length:
-                        stable_count += 1
-                        # Если длина не меняется 5 секунд подряд - генерация завершена
-                        if stable_count >= 5:
-                            logger.info(f"✓ Генерация завершена. Длина ответа: {current_length}")
-                            return response_text
-                    else:
-                        stable_count = 0
-                    
-                    previous_length = current_length
-                    
-                    if i % 10 == 0 and i > 0:
-                        img_count = len(images) if images else 0
-                        logger.info(f"Генерация продолжается... (текст: {current_length} симв.{', изображение: да' if img_count > 0 else ''})")
-            
-            # Если вышли по таймауту, возвращаем что есть
-            if has_images:
-                logger.info("Таймаут, но изображение сгенерировано")
-                responses = await page.query_selector_all(response_selector)
-                if responses:
-                    response_text = await responses[-1].inner_text()
-                    return response_text if len(response_text) > 0 else "Изображение создано"
-                return "Изображение создано"
-            
-            if previous_length > 10:
-                logger.info(f"Таймаут, но есть ответ: {previous_length} символов")
-                responses = await page.query_selector_all(response_selector)
-                if responses:
-                    response_text = await responses[-1].inner_text()
-                    
-                    # Проверяем наличие файлов
-                    files = await self._check_for_files(page)
-                    if files:
-                        response_text += f"\n\n📎 Обнаружено файлов: {len(files)}"
-                    
-                    return response_text
-            
-            return "Не удалось получить ответ от ChatGPT (таймаут)"
+            return await self._wait_for_response(page, baseline, check_files=True, on_text=on_text)
             
         except Exception as e:
             logger.error(f"Ошибка отправки запроса: {e}", exc_info=True)
-            return f"Ошибка получения ответа: {str(e)}"
+            return IncompleteResponse(f"Ошибка получения ответа: {str(e)}")
     
-    async def _send_photo_and_get_response(self, page: Page, photo_path: str, caption: str = "") -> str:
+    async def _send_photo_and_get_response(self, page: Page, photo: bytes, filename: str, caption: str = "",
+                                           on_text=None) -> str:
         """Отправка фото с текстом и получение ответа"""
         try:
             logger.info("Поиск кнопки загрузки файла...")
@@ -981,38 +1534,25 @@ class BrowserManager:
             
             file_input = None
             
-            # Ищем input[type="file"] напрямую или через кнопку
-            for selector in upload_button_selectors:
-                try:
-                    if 'input[type="file"]' in selector:
-                        file_input = await page.query_selector(selector)
-                        if file_input:
-                            logger.info("Найден input для загрузки файла")
-                            break
-                    else:
-                        # Пробуем найти кнопку и получить связанный input
-                        button = await page.query_selector(selector)
-                        if button:
-                            # Ищем input рядом с кнопкой
-                            file_input = await page.query_selector('input[type="file"]')
-                            if file_input:
-                                logger.info(f"Найдена кнопка загрузки: `{selector}`")
-                                break
-                except:
-                    continue
-            
-            # Если не нашли, ищем любой input[type="file"]
-            if not file_input:
+            # Ищем input[type="file"] напрямую или через кнопку (скрытый input тоже подходит)
+            selector = await selector_registry.resolve(page, 'upload_button', upload_button_selectors,
+                                                       timeout=10, state='attached')
+            if selector:
+                logger.info(f"Найдена кнопка загрузки: `{selector}`")
+                # Файл передается через input рядом с кнопкой
                 file_input = await page.query_selector('input[type="file"]')
             
             if not file_input:
                 logger.error("Не найдена кнопка загрузки файла")
-                return "Ошибка: не найдена кнопка загрузки файла в ChatGPT"
+                return IncompleteResponse("Ошибка: не найдена кнопка загрузки файла в ChatGPT")
             
             # Загружаем файл
-            logger.info(f"Загрузка файла: {photo_path}")
-            await file_input.set_input_files(photo_path)
-            await asyncio.sleep(2)
+            logger.info(f"Загрузка файла: {filename} ({len(photo)} байт)")
+            with tracing.span('photo_upload'):
+                # Фото передается из памяти, без временного файла на диске
+                await file_input.set_input_files({'name': filename, 'mimeType': 'image/jpeg', 'buffer': photo})
+                if not await waits.wait_for_upload_chip(page, timeout=30):
+                    logger.warning("Не дождались загрузки фото в поле ввода, отправляем как есть")
             
             # Если есть текст, добавляем его
             if caption:
@@ -1025,102 +1565,46 @@ class BrowserManager:
                     'textarea'
                 ]
                 
-                for selector in input_selectors:
+                selector = await selector_registry.resolve(page, 'caption_input', input_selectors,
+                                                           timeout=3, state='attached')
+                if selector:
                     try:
-                        await page.wait_for_selector(selector, timeout=3000, state='attached')
                         await page.fill(selector, caption)
                         logger.info(f"Текст добавлен через селектор: `{selector}`")
-                        break
-                    except:
-                        continue
+                    except Exception as e:
+                        logger.warning(f"Не удалось добавить текст к фото: {e}")
                 
-                await asyncio.sleep(1)
+                await waits.wait_for_send_ready(page, timeout=3)
+            
+            # Запоминаем количество ответов до отправки, чтобы дождаться именно нового
+            baseline = await self._count_assistant_messages(page)
             
             # Отправка
             logger.info("Отправка фото...")
             await page.keyboard.press('Enter')
             
-            # Ожидание ответа (используем ту же логику что и для текста)
-            await asyncio.sleep(3)
-            
-            response_selector = 'div[data-message-author-role="assistant"]'
-            logger.info("Ожидание ответа от ChatGPT...")
-            
-            previous_length = 0
-            stable_count = 0
-            has_images = False
-            
-            for i in range(120):
-                await asyncio.sleep(1)
-                
-                # Проверяем наличие изображений (кнопки "Поделиться")
-                images = await self._check_for_generated_images(page)
-                if images and not has_images:
-                    logger.info(f"✓ Обнаружена генерация изображения!")
-                    has_images = True
-                
-                responses = await page.query_selector_all(response_selector)
-                if responses:
-                    last_response = responses[-1]
-                    response_text = await last_response.inner_text()
-                    current_length = len(response_text)
-                    
-                    # Если есть изображение и текст не растёт - генерация завершена
-                    if has_images and current_length == previous_length:
-                        stable_count += 1
-                        if stable_count >= 5:
-                            logger.info(f"✓ Генерация изображения завершена. Текст: {current_length} символов")
-                            return response_text if current_length > 0 else "Изображение создано"
-                    # Если только текст без изображений
-                    elif current_length > 10 and current_length == previous_length:
-                        stable_count += 1
-                        if stable_count >= 5:
-                            logger.info(f"✓ Генерация завершена. Длина ответа: {current_length}")
-                            return response_text
-                    else:
-                        stable_count = 0
-                    
-                    previous_length = current_length
-                    
-                    if i % 10 == 0 and i > 0:
-                        img_count = len(images) if images else 0
-                        logger.info(f"Генерация продолжается... (текст: {current_length} симв.{', изображение: да' if img_count > 0 else ''})")
-            
-            # Если вышли по таймауту, возвращаем что есть
-            if has_images:
-                logger.info("Таймаут, но изображение сгенерировано")
-                responses = await page.query_selector_all(response_selector)
-                if responses:
-                    response_text = await responses[-1].inner_text()
-                    return response_text if len(response_text) > 0 else "Изображение создано"
-                return "Изображение создано"
-            
-            if previous_length > 10:
-                logger.info(f"Таймаут, но есть ответ: {previous_length} символов")
-                responses = await page.query_selector_all(response_selector)
-                if responses:
-                    return await responses[-1].inner_text()
-            
-            return "Не удалось получить ответ от ChatGPT (таймаут)"
+            return await self._wait_for_response(page, baseline, on_text=on_text)
             
         except Exception as e:
             logger.error(f"Ошибка отправки фото: {e}", exc_info=True)
-            return f"Ошибка отправки фото: {str(e)}"
+            return IncompleteResponse(f"Ошибка отправки фото: {str(e)}")
     
-    async def _save_conversation(self, project_path: Path, query: str, response: str):
-        """Сохранение переписки в файл"""
+    def _save_conversation(self, username: str, kind: str, query: str, response: str):
+        """Сохранение переписки в историю (запись выполняется в фоне)"""
+        if self.history is None:
+            return
         try:
-            conversation_file = project_path / "conversation.txt"
-            with open(conversation_file, 'a', encoding='utf-8') as f:
-                f.write(f"\n{'='*50}\n")
-                f.write(f"Запрос: {query}\n")
-                f.write(f"Ответ: {response}\n")
+            self.history.append(username, kind, query, response)
         except Exception as e:
             logger.error(f"Ошибка сохранения переписки: {e}")
     
     async def stop(self):
         """Остановка браузера"""
         try:
+            # Вкладки пула больше недоступны до следующего запуска
+            for slot in self.pool.slots:
+                slot.healthy = False
+            
             if self.browser:
                 logger.info("Закрытие браузера...")
                 try:
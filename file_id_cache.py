@@ -0,0 +1,63 @@
+"""
+Кэш file_id отправленных в Telegram файлов по хэшу содержимого.
+Файл с теми же байтами повторно не загружается - отправляется ссылка на уже
+загруженный. Размер кэша ограничен (вытесняются давно не использованные записи),
+содержимое сохраняется на диск атомарной записью.
+"""
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import tracing
+from json_store import JsonStore
+
+logger = logging.getLogger(__name__)
+
+tracing.metrics.describe('tgbot_file_id_cache_total', 'Поиски file_id по содержимому файла (result=hit|miss)')
+
+
+class FileIdCache:
+    """LRU-словарь (вид, sha256, размер) -> file_id"""
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._store = JsonStore(path, 'кэша file_id')
+        self._entries = self._load()
+
+    @staticmethod
+    def _key(kind: str, sha256: str, size: int) -> str:
+        return f"{kind}:{sha256}:{size}"
+
+    def _load(self) -> OrderedDict:
+        entries = OrderedDict(self._store.load({}))
+        if entries:
+            logger.info(f"Кэш file_id загружен: {len(entries)} файлов")
+        return entries
+
+    def get(self, kind: str, sha256: str, size: int) -> Optional[str]:
+        """file_id ранее отправленного файла с таким же содержимым"""
+        key = self._key(kind, sha256, size)
+        file_id = self._entries.get(key)
+        if file_id is None:
+            tracing.metrics.inc('tgbot_file_id_cache_total', result='miss')
+            return None
+        self._entries.move_to_end(key)
+        tracing.metrics.inc('tgbot_file_id_cache_total', result='hit')
+        return file_id
+
+    async def put(self, kind: str, sha256: str, size: int, file_id: str):
+        key = self._key(kind, sha256, size)
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        await self._save()
+
+    async def forget(self, kind: str, sha256: str, size: int):
+        """Удаление file_id, который Telegram больше не принимает"""
+        if self._entries.pop(self._key(kind, sha256, size), None) is not None:
+            await self._save()
+
+    async def _save(self):
+        await self._store.save(lambda: dict(self._entries))
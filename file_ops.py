@@ -0,0 +1,121 @@
+"""
+Асинхронные файловые операции.
+Блокирующие вызовы (open/write, os.makedirs, декодирование base64,
+сериализация JSON) выполняются в отдельном ограниченном пуле потоков, чтобы большой файл одного
+пользователя не останавливал цикл событий для остальных. Задержка цикла событий
+измеряется фоновой задачей и попадает в метрики.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Корзины для задержки цикла событий (сек): интересны миллисекунды
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+tracing.metrics.describe('tgbot_event_loop_lag_seconds', 'Опоздание пробуждения задачи в цикле событий')
+tracing.metrics.describe('tgbot_file_io_seconds', 'Длительность файловых операций в пуле потоков')
+
+_executor = None
+_lag_task = None
+
+
+def configure(workers: int = 4):
+    """Размер пула потоков для файловых операций (вызывать до первой операции)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='file-io')
+    logger.info(f"Пул файловых операций: {workers} потоков")
+
+
+async def run(op: str, func, *args):
+    """Выполнение блокирующей функции в пуле файловых операций"""
+    if _executor is None:
+        configure()
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        tracing.metrics.observe('tgbot_file_io_seconds', time.perf_counter() - started, LAG_BUCKETS, op=op)
+
+
+def _write_text(path: str, text: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _write_atomic(path: str, text: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_json_atomic(path: str, data, options: dict):
+    _write_atomic(path, json.dumps(data, **options))
+
+
+async def write_text(path: str, text: str):
+    await run('write', _write_text, path, text)
+
+
+async def write_atomic(path: str, text: str):
+    """Запись файла целиком: читатели видят либо старое, либо новое содержимое"""
+    await run('write', _write_atomic, path, text)
+
+
+async def write_json_atomic(path: str, data, **options):
+    """Атомарная запись data в JSON; сериализация тоже выполняется в пуле потоков"""
+    await run('write', _write_json_atomic, path, data, options)
+
+
+async def makedirs(path: str):
+    await run('makedirs', lambda: os.makedirs(path, exist_ok=True))
+
+
+async def _monitor_lag(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        tracing.metrics.observe('tgbot_event_loop_lag_seconds', lag, LAG_BUCKETS)
+        if lag > 1:
+            logger.warning(f"Цикл событий был заблокирован на {lag:.2f} сек")
+
+
+def start_lag_monitor(interval: float = 0.5):
+    """Запуск фонового измерения задержки цикла событий"""
+    global _lag_task
+    if _lag_task is None:
+        _lag_task = asyncio.create_task(_monitor_lag(interval))
+
+
+async def shutdown():
+    """Остановка монитора и пула потоков"""
+    global _lag_task, _executor
+    if _lag_task:
+        _lag_task.cancel()
+        _lag_task = None
+    if _executor:
+        await asyncio.to_thread(_executor.shutdown, True)
+        _executor = None
@@ -0,0 +1,285 @@
+"""
+Форматирование ответов ChatGPT для Telegram (Markdown).
+Ответ разбирается за один проход по строкам: текст, блоки кода из кнопки
+"Копировать код" и уже размеченные блоки ```. Селекторы и теги в тексте
+оборачиваются в инлайн-код одним предкомпилированным выражением, код не изменяется.
+
+Разбор инкрементальный (IncrementalFormatter): при стриминге обрабатываются только
+новые строки ответа, а промежуточный текст всегда имеет закрытую разметку.
+Ответ, разметка которого уже собрана из страницы, передается как FormattedResponse.
+"""
+import bisect
+import copy
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Подпись кнопки копирования в тексте ответа; перед ней - язык блока кода
+_COPY_MARKER_RE = re.compile(r'^(?P<lang>.*?)(?:Копировать код|Copy code)(?P<rest>.*)$')
+
+# Строка, открывающая или закрывающая блок ```
+_FENCE_RE = re.compile(r'^\s*```')
+
+# Строка, с которой после блока кода снова начинается текст (Q1, Q2 и т.д.)
+_QUESTION_RE = re.compile(r'^\s*Q\d+', re.IGNORECASE)
+
+# Название языка перед кнопкой копирования (в той же или в предыдущей строке)
+_LANG_RE = re.compile(r'^[A-Za-z][\w+#.-]{0,19}$', re.ASCII)
+
+# Что оборачивается в инлайн-код; уже размеченный инлайн-код остается как есть
+_INLINE_RE = re.compile(
+    r'(?P<code>`[^`\n]*`)'
+    r'|\w+\[[\w*="\'-]+\]'  # Атрибутные селекторы: textarea[placeholder*="Message"]
+    r'|#[\w-]+'  # ID селекторы: #prompt-textarea
+    r'|\b(?:textarea|input)\b(?!\[)'  # Одиночные теги
+)
+
+# Символы, открывающие и закрывающие сущность Markdown
+_ENTITY_RE = re.compile(r'[*_`]')
+
+
+def _wrap_inline(match: re.Match) -> str:
+    if match.group('code'):
+        return match.group(0)
+    return f"`{match.group(0)}`"
+
+
+def _scan_entities(text: str, entity, index: int, start: int = 0):
+    """
+    Незакрытая сущность после text (вложенности в Markdown нет).
+    Сущность - (символ, номер фрагмента, позиция символа во фрагменте) или None.
+    """
+    for match in _ENTITY_RE.finditer(text, start):
+        char = match.group()
+        if entity is None:
+            entity = (char, index, match.start())
+        elif char == entity[0]:
+            entity = None
+    return entity
+
+
+def _escape_at(text: str, pos: int) -> str:
+    return text[:pos] + '\\' + text[pos:]
+
+
+def _escape_unclosed(pieces: list, entity, undo: list = None):
+    """
+    Экранирование символов разметки, не закрытых до конца абзаца.
+    entity - первый незакрытый; после него абзац просматривается заново, потому что
+    следующие символы могли быть приняты за его содержимое.
+    """
+    while entity is not None:
+        _, index, pos = entity
+        if undo is not None:
+            undo.append((len(pieces), index, pieces[index]))
+        pieces[index] = _escape_at(pieces[index], pos)
+        entity = _scan_entities(pieces[index], None, index, pos + 2)
+        for i in range(index + 1, len(pieces)):
+            entity = _scan_entities(pieces[i], entity, i)
+
+
+class IncrementalFormatter:
+    """
+    Форматирование ответа, поступающего фрагментами.
+    feed() разбирает только новые целые строки; snapshot() возвращает текущий результат
+    с закрытыми блоками кода и разметкой. Символ разметки, не закрытый до конца
+    абзаца, экранируется - это одиночный символ (snake_case, 2 * 3). Если ранее
+    полученный текст изменился (offset в feed), разбор откатывается к началу затронутой строки.
+    """
+
+    def __init__(self, rewindable: bool = True):
+        self._pieces = []  # Готовые фрагменты результата
+        self._tail = ''  # Незавершенная строка входа
+        self._mode = 'text'  # 'text', 'code' (после "Копировать код") или 'fence' (блок ```)
+        self._lang = ''
+        self._started = False  # В текущем блоке уже есть непустая строка
+        self._blank = 0  # Отложенные пустые строки: в конце блока они не нужны
+        self._label = None  # Строка, похожая на язык блока кода: решается на следующей строке
+        self._entity = None  # Незакрытая разметка в текущем абзаце
+        self._undo = []  # Экранированные фрагменты: (число фрагментов в тот момент, номер, прежний текст)
+        # Для отката: строки входа, их позиции и состояние разбора перед каждой
+        self._rewindable = rewindable
+        self._lines = []
+        self._positions = []
+        self._states = []
+        self._consumed = 0  # Символов входа в целых строках
+
+    # --- Вход ---
+
+    def feed(self, chunk: str, offset: int = None):
+        """Новый фрагмент ответа; offset - позиция, с которой он заменяет уже полученный текст"""
+        if offset is not None:
+            self._rewind(offset)
+        if '\n' not in chunk:
+            self._tail += chunk
+            return
+        lines = (self._tail + chunk).split('\n')
+        self._tail = lines.pop()
+        for line in lines:
+            if self._rewindable:
+                self._positions.append(self._consumed)
+                self._states.append((len(self._pieces), self._mode, self._lang, self._started,
+                                     self._blank, self._label, self._entity))
+                self._lines.append(line)
+            self._consumed += len(line) + 1
+            self._line(line)
+
+    def _rewind(self, offset: int):
+        if offset >= self._consumed:
+            self._tail = self._tail[:offset - self._consumed]
+            return
+        if not self._rewindable:
+            raise ValueError("Откат разбора не поддерживается")
+        index = bisect.bisect_right(self._positions, offset) - 1
+        (pieces, self._mode, self._lang, self._started,
+         self._blank, self._label, self._entity) = self._states[index]
+        while self._undo and self._undo[-1][0] >= pieces:
+            _, piece, original = self._undo.pop()
+            self._pieces[piece] = original
+        del self._pieces[pieces:]
+        self._consumed = self._positions[index]
+        self._tail = self._lines[index][:offset - self._consumed]
+        del self._lines[index:], self._positions[index:], self._states[index:]
+
+    # --- Разбор строк ---
+
+    def _line(self, line: str):
+        if self._mode == 'fence':
+            self._pieces.append('\n' + line)
+            if _FENCE_RE.match(line):
+                self._mode = 'text'
+                self._started = False
+            return
+
+        marker = _COPY_MARKER_RE.match(line)
+        if self._mode == 'code':
+            if not marker and not _QUESTION_RE.match(line) and not _FENCE_RE.match(line):
+                self._block_line(line, code=True)
+                return
+            self._close_code()
+
+        label = self._label
+        self._label = None
+        if marker:
+            prefix = marker.group('lang').strip()
+            if label is not None and prefix:
+                self._text_line(label)
+            label = prefix or label or ''
+            lang = label if _LANG_RE.match(label) else ''
+            if label and not lang:
+                self._text_line(label)
+            self._mode = 'code'
+            self._lang = lang
+            self._started = False
+            self._blank = 0
+            self._block_line(marker.group('rest'), code=True)
+            return
+
+        if label is not None:
+            self._text_line(label)
+        if _FENCE_RE.match(line):
+            self._separate()
+            self._pieces.append(line)
+            self._mode = 'fence'
+            self._started = True
+        elif _LANG_RE.match(line.strip()):
+            self._label = line.strip()
+        else:
+            self._text_line(line)
+
+    def _escape_entity(self):
+        """Незакрытый символ разметки в конце абзаца экранируется"""
+        _escape_unclosed(self._pieces, self._entity, self._undo if self._rewindable else None)
+        self._entity = None
+
+    def _separate(self):
+        """Конец текущего блока и пустая строка перед следующим"""
+        if self._entity is not None:
+            self._escape_entity()
+        if self._pieces:
+            self._pieces.append('\n\n')
+        self._blank = 0
+
+    def _text_line(self, line: str):
+        self._block_line(_INLINE_RE.sub(_wrap_inline, line), code=False)
+
+    def _block_line(self, line: str, code: bool):
+        if not line.strip():
+            if self._started:
+                self._blank += 1
+            return
+        if not self._started:
+            self._separate()
+            piece = f"```{self._lang}\n{line}" if code else line.lstrip()
+            self._started = True
+        else:
+            if self._blank and self._entity is not None:
+                self._escape_entity()
+            piece = '\n' * (self._blank + 1) + line
+            self._blank = 0
+        self._pieces.append(piece)
+        if not code:
+            self._entity = _scan_entities(piece, self._entity, len(self._pieces) - 1)
+
+    def _close_code(self):
+        if self._started:
+            self._pieces.append('\n```')
+        self._mode = 'text'
+        self._started = False
+        self._blank = 0
+
+    # --- Результат ---
+
+    def snapshot(self) -> str:
+        """Текущий результат с закрытыми блоками кода и разметкой (для промежуточного показа)"""
+        # Незавершенная строка дописывается в копию, как если бы ответ на ней закончился
+        clone = copy.copy(self)
+        clone._pieces = self._pieces.copy()
+        clone._rewindable = False
+        return clone.finish()
+
+    def finish(self) -> str:
+        """Окончательный результат после получения ответа целиком"""
+        if self._tail:
+            tail, self._tail = self._tail, ''
+            self.feed(tail + '\n')
+        if self._label is not None:
+            self._text_line(self._label)
+            self._label = None
+        if self._mode == 'code':
+            self._close_code()
+        elif self._mode == 'fence':
+            # Незакрытый блок ``` (ответ оборван) - закрываем, чтобы не сломать разметку
+            self._pieces.append('\n```')
+            self._mode = 'text'
+        if self._entity is not None:
+            self._escape_entity()
+        return ''.join(self._pieces)
+
+
+class FormattedResponse(str):
+    """Текст ответа, к которому приложена разметка, собранная из DOM страницы.
+    markdown - тот же ответ в Telegram Markdown с настоящими блоками кода и ссылками.
+    """
+
+    def __new__(cls, text: str, markdown: str):
+        response = super().__new__(cls, text)
+        response.markdown = markdown
+        return response
+
+
+def format_response_for_telegram(response: str) -> str:
+    """
+    Форматирование ответа ChatGPT для Telegram.
+    Блоки кода (после "Копировать код"/"Copy code" до строки Q1, Q2... или следующего
+    блока) отделяются от текста и оформляются как ```; селекторы и теги в тексте
+    оборачиваются в инлайн-код. Содержимое блоков кода не изменяется.
+    """
+    try:
+        formatter = IncrementalFormatter(rewindable=False)
+        formatter.feed(response)
+        return formatter.finish()
+    except Exception as e:
+        logger.error(f"Ошибка форматирования ответа: {e}")
+        return response
@@ -0,0 +1,219 @@
+"""
+Хранилище истории переписки на SQLite (режим WAL).
+Записи копятся в очереди и пишутся пачками отдельным потоком, поэтому сохранение
+не блокирует цикл событий. Чтение постраничное по ключу (ts, id) через индекс
+(user_id, ts) - стоимость страницы не зависит от объема истории.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import file_ops
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    query TEXT NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_user_ts ON messages (user_id, ts);
+'''
+
+# Сколько строк удалять за одну транзакцию очистки, чтобы не держать блокировку долго
+RETENTION_BATCH = 5000
+
+
+class HistoryEntry:
+    """Запись истории: запрос пользователя и ответ ChatGPT"""
+
+    __slots__ = ('id', 'user_id', 'ts', 'kind', 'query', 'response')
+
+    def __init__(self, id: int, user_id: str, ts: float, kind: str, query: str, response: str):
+        self.id = id
+        self.user_id = user_id
+        self.ts = ts
+        self.kind = kind  # 'text' или 'photo'
+        self.query = query
+        self.response = response
+
+    @property
+    def cursor(self) -> str:
+        """Курсор для запроса следующей (более старой) страницы"""
+        return f"{self.ts!r}:{self.id}"
+
+
+def parse_cursor(cursor: str) -> Optional[tuple]:
+    """(ts, id) из курсора страницы или None для некорректного курсора"""
+    try:
+        ts, entry_id = cursor.split(':', 1)
+        return float(ts), int(entry_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+class HistoryStore:
+    """
+    История переписки пользователей.
+    append() только ставит запись в очередь; поток записи сохраняет накопленное
+    одной транзакцией и периодически удаляет записи старше retention_days.
+    """
+
+    def __init__(self, path: str, retention_days: float = 0, batch_size: int = 200,
+                 flush_interval: float = 0.5, retention_interval: float = 3600):
+        self.path = path
+        self.retention_days = retention_days  # 0 - хранить бессрочно
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_interval = retention_interval
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def start(self):
+        """Создание базы и запуск потока записи"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        # auto_vacuum действует только если задан до создания таблиц
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.executescript(SCHEMA)
+        conn.commit()
+        conn.close()
+
+        self._read_conn = self._connect()
+        self._thread = threading.Thread(target=self._writer, name='history-writer', daemon=True)
+        self._thread.start()
+        logger.info(f"История переписки: {self.path}" +
+                    (f", хранение {self.retention_days} дн." if self.retention_days else ""))
+
+    async def stop(self):
+        """Запись оставшихся записей и закрытие базы"""
+        if self._thread:
+            self._queue.put(None)
+            await file_ops.run('history_stop', self._thread.join)
+            self._thread = None
+        if self._read_conn:
+            self._read_conn.close()
+            self._read_conn = None
+
+    def append(self, user_id: str, kind: str, query: str, response: str):
+        """Постановка записи в очередь на сохранение (не блокирует)"""
+        self._queue.put((user_id, time.time(), kind, query, response))
+
+    # --- Поток записи ---
+
+    def _writer(self):
+        conn = self._connect()
+        next_retention = time.monotonic()
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                # Добираем все, что накопилось, одной транзакцией
+                while len(batch) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(
+                            'INSERT INTO messages (user_id, ts, kind, query, response) VALUES (?, ?, ?, ?, ?)',
+                            batch,
+                        )
+                except Exception as e:
+                    logger.error(f"Ошибка записи истории ({len(batch)} записей потеряно): {e}")
+
+            if self.retention_days and time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + self.retention_interval
+                self._apply_retention(conn)
+        conn.close()
+
+    def _apply_retention(self, conn: sqlite3.Connection):
+        """Удаление записей старше срока хранения небольшими порциями"""
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+        try:
+            while True:
+                with conn:
+                    cursor = conn.execute(
+                        'DELETE FROM messages WHERE id IN (SELECT id FROM messages WHERE ts < ? LIMIT ?)',
+                        (cutoff, RETENTION_BATCH),
+                    )
+                removed += cursor.rowcount
+                if cursor.rowcount < RETENTION_BATCH:
+                    break
+            if removed:
+                # Возвращаем освободившиеся страницы файлу и укорачиваем WAL
+                conn.execute('PRAGMA incremental_vacuum')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                logger.info(f"Удалено устаревших записей истории: {removed}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки истории: {e}")
+
+    # --- Чтение ---
+
+    def _read_page(self, user_id: str, limit: int, before: Optional[tuple]) -> list:
+        with self._read_lock:
+            if before:
+                rows = self._read_conn.execute(
+                    'SELECT id, user_id, ts, kind, query, response FROM messages '
+                    # ts <= ? задает диапазон по индексу, второе условие отсекает уже показанное
+                    'WHERE user_id = ? AND ts <= ? AND (ts < ? OR id < ?) '
+                    'ORDER BY ts DESC, id DESC LIMIT ?',
+                    (user_id, before[0], before[0], before[1], limit),
+                ).fetchall()
+            else:
+                rows = self._read_conn.execute(
+                    'SELECT id, user_id, ts, kind, query, response FROM messages '
+                    'WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT ?',
+                    (user_id, limit),
+                ).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+    async def page(self, user_id: str, limit: int = 5, cursor: str = None) -> tuple:
+        """
+        Страница истории пользователя, от новых записей к старым.
+
+        Args:
+            cursor: курсор из предыдущей страницы (None - самые новые записи)
+
+        Returns:
+            tuple: (список HistoryEntry, курсор следующей страницы или None)
+        """
+        before = parse_cursor(cursor) if cursor else None
+        # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        entries = await file_ops.run('history_read', self._read_page, user_id, limit + 1, before)
+        if len(entries) > limit:
+            entries = entries[:limit]
+            return entries, entries[-1].cursor
+        return entries, None
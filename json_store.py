@@ -0,0 +1,52 @@
+"""
+Небольшое хранилище в JSON-файле: читается при запуске, перезаписывается целиком.
+Запись атомарная, а сериализация и запись выполняются в пуле файловых операций,
+поэтому большой файл не останавливает цикл событий. Сохранения, запрошенные
+во время записи, объединяются в одно следующее.
+"""
+import asyncio
+import json
+import logging
+
+import file_ops
+
+logger = logging.getLogger(__name__)
+
+
+class JsonStore:
+    """JSON-файл path; name - что в нем хранится (для журнала, в родительном падеже)"""
+
+    def __init__(self, path: str, name: str, **dumps_options):
+        self.path = path
+        self.name = name
+        self._dumps_options = dumps_options
+        self._lock = asyncio.Lock()  # Сохранения выполняются по одному
+        self._dirty = False
+
+    def load(self, default=None):
+        """Содержимое файла или default, если файла нет или он поврежден"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logger.error(f"Ошибка чтения {self.name} {self.path}: {e}")
+            return default
+
+    async def save(self, snapshot):
+        """Запись данных, которые возвращает snapshot()
+
+        snapshot вызывается в цикле событий непосредственно перед записью и должен
+        вернуть копию, которую не изменят, пока она сериализуется в другом потоке.
+        """
+        # Изменения, пришедшие во время записи, сохранит следующая запись
+        self._dirty = True
+        async with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                await file_ops.write_json_atomic(self.path, snapshot(), **self._dumps_options)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения {self.name}: {e}")
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Индикатор "печатает" в Telegram гаснет через ~5 секунд
+TYPING_REFRESH = 4.5
+
+# Сколько редакторов чатов держать в памяти (давно не использованные вытесняются)
+MAX_EDITORS = 1000
+
+
+class ChatEditor:
+    """
+    Редактор живых сообщений одного чата.
+    Хранит только последний текст для каждого сообщения, отправляет не больше
+    одного edit_text за interval секунд на весь чат и пропускает правки без изменений.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, interval: float = 1.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self._pending = {}  # message_id -> (text, parse_mode), ожидающие отправки
+        self._sent = {}  # message_id -> последний отправленный текст
+        self._lock = asyncio.Lock()  # Правки чата отправляются строго по одной
+        self._next_edit_at = 0.0  # Раньше этого времени следующую правку не отправляем
+        self._typing_at = 0.0
+        self._task = None
+
+    def update(self, message_id: int, text: str, parse_mode: str = None):
+        """Новый текст сообщения: заменяет еще не отправленный предыдущий"""
+        if self._sent.get(message_id) == text:
+            self._pending.pop(message_id, None)
+            return
+        self._pending[message_id] = (text, parse_mode)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def finish(self, message_id: int, text: str, parse_mode: str = None, entities: list = None) -> bool:
+        """
+        Финальная правка сообщения: отправляется сразу после ближайшего окна.
+        Разметка задается либо parse_mode, либо готовыми entities.
+
+        Returns:
+            bool: True если сообщение содержит этот текст
+        """
+        self._pending.pop(message_id, None)
+        try:
+            return await self._edit(message_id, text, parse_mode, entities)
+        finally:
+            self._sent.pop(message_id, None)
+
+    def idle(self) -> bool:
+        """Нет ожидающих и выполняющихся правок, и окно лимита уже прошло"""
+        return (
+            not self._pending
+            and (self._task is None or self._task.done())
+            and not self._lock.locked()
+            and asyncio.get_running_loop().time() >= self._next_edit_at
+        )
+
+    async def typing(self):
+        """Индикатор "печатает", не чаще чем он успевает погаснуть"""
+        now = asyncio.get_running_loop().time()
+        if now - self._typing_at < TYPING_REFRESH:
+            return
+        self._typing_at = now
+        try:
+            await self.bot.send_chat_action(self.chat_id, "typing")
+        except Exception as e:
+            logger.debug(f"Ошибка отправки индикатора: {e}")
+
+    async def _run(self):
+        """Отправка накопленных правок по одной за интервал"""
+        while self._pending:
+            message_id = next(iter(self._pending))
+            text, parse_mode = self._pending.pop(message_id)
+            await self._edit(message_id, text, parse_mode)
+
+    async def _edit(self, message_id: int, text: str, parse_mode: str = None, entities: list = None) -> bool:
+        async with self._lock:
+            if self._sent.get(message_id) == text:
+                return True
+
+            while True:
+                delay = self._next_edit_at - asyncio.get_running_loop().time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    # Пока ждали, мог прийти более свежий текст - отправляем сразу его
+                    newer = self._pending.pop(message_id, None)
+                    if newer:
+                        text, parse_mode = newer
+                        entities = None
+                try:
+                    await self.bot.edit_message_text(
+                        text, chat_id=self.chat_id, message_id=message_id, parse_mode=parse_mode,
+                        entities=entities,
+                    )
+                    self._sent[message_id] = text
+                    return True
+                except RetryAfter as e:
+                    # Flood control: ждем сколько сказал Telegram и повторяем
+                    logger.warning(f"Rate limit при редактировании в чате {self.chat_id} - ожидание {e.retry_after} сек")
+                    self._next_edit_at = asyncio.get_running_loop().time() + float(e.retry_after)
+                except BadRequest as e:
+                    if 'not modified' in str(e).lower():
+                        self._sent[message_id] = text
+                        return True
+                    logger.debug(f"Ошибка редактирования сообщения: {e}")
+                    return False
+                except Exception as e:
+                    logger.debug(f"Ошибка редактирования сообщения: {e}")
+                    return False
+                finally:
+                    self._next_edit_at = max(
+                        self._next_edit_at, asyncio.get_running_loop().time() + self.interval
+                    )
+
+
+_editors = OrderedDict()  # chat_id -> ChatEditor, от давно использованных к недавним
+
+
+def get_chat_editor(bot: Bot, chat_id: int, interval: float = 1.0) -> ChatEditor:
+    """Редактор сообщений чата (один на чат, чтобы лимит правок был общим)"""
+    editor = _editors.get(chat_id)
+    if editor is None:
+        editor = _editors[chat_id] = ChatEditor(bot, chat_id, interval)
+        _evict_idle()
+    else:
+        _editors.move_to_end(chat_id)
+    return editor
+
+
+def _evict_idle():
+    """Вытеснение давно не использованных редакторов без незавершенных правок"""
+    excess = len(_editors) - MAX_EDITORS
+    if excess <= 0:
+        return
+    for chat_id in [chat_id for chat_id, editor in _editors.items() if editor.idle()][:excess]:
+        del _editors[chat_id]
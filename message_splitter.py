@@ -0,0 +1,153 @@
+"""
+Разбиение длинного ответа на сообщения Telegram с готовой разметкой.
+Markdown (подмножество, которое выдает formatting: ```блоки```, `код`, *жирный*,
+_курсив_, [ссылки](url), экранирование \\) разбирается на стороне бота в текст
+и список MessageEntity. Сообщения режутся по абзацам и строкам, блок кода,
+попавший на границу, закрывается в одной части и продолжается в следующей.
+Серверу не нужно разбирать Markdown, поэтому части не отклоняются из-за
+разорванной разметки.
+"""
+import re
+
+from telegram import MessageEntity
+
+# Максимальная длина сообщения Telegram (в единицах UTF-16)
+MESSAGE_LIMIT = 4096
+
+_TOKEN_RE = re.compile(
+    r'```(?P<lang>[^\n`]*)\n?(?P<pre>.*?)```'
+    r'|`(?P<code>[^`\n]+)`'
+    r'|\*(?P<bold>[^*]+)\*'
+    r'|_(?P<italic>[^_]+)_'
+    r'|\[(?P<link>[^\]\n]+)\]\((?P<url>[^)\s]+)\)'
+    r'|\\(?P<escaped>[*_`\[])',
+    re.DOTALL,
+)
+
+# Языки блоков кода: только безопасные символы
+_LANG_RE = re.compile(r'^[\w+#.-]{1,32}$')
+
+
+def utf16_len(text: str) -> int:
+    """Длина строки в единицах UTF-16 (в них Telegram считает длину и смещения)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def parse_markdown(markdown: str) -> tuple:
+    """
+    Текст без разметки и сущности.
+
+    Returns:
+        tuple: (text, [(type, start, end, extra)]) - позиции в символах Python,
+            extra - язык блока кода или адрес ссылки
+    """
+    parts = []
+    entities = []
+    length = 0
+    last = 0
+    for match in _TOKEN_RE.finditer(markdown):
+        if match.start() > last:
+            plain = markdown[last:match.start()]
+            parts.append(plain)
+            length += len(plain)
+        last = match.end()
+
+        kind = match.lastgroup
+        if kind == 'escaped':
+            parts.append(match.group('escaped'))
+            length += 1
+            continue
+        if kind == 'url':
+            content, entity_type = match.group('link'), MessageEntity.TEXT_LINK
+            extra = match.group('url')
+        elif kind == 'pre':
+            content, entity_type = match.group('pre').rstrip('\n'), MessageEntity.PRE
+            lang = match.group('lang').strip()
+            extra = lang if _LANG_RE.match(lang) else None
+        else:
+            content = match.group(kind)
+            entity_type = {
+                'code': MessageEntity.CODE, 'bold': MessageEntity.BOLD, 'italic': MessageEntity.ITALIC,
+            }[kind]
+            extra = None
+        if content:
+            entities.append((entity_type, length, length + len(content), extra))
+            parts.append(content)
+            length += len(content)
+    parts.append(markdown[last:])
+    return ''.join(parts), entities
+
+
+def _find_cut(text: str, start: int, limit: int) -> tuple:
+    """(конец части, начало следующей): по абзацу, строке, пробелу или жестко по лимиту"""
+    end = start + limit
+    # Символы вне BMP занимают две единицы UTF-16 - уменьшаем, пока часть не уложится
+    while True:
+        excess = utf16_len(text[start:end]) - limit
+        if excess <= 0:
+            break
+        end -= (excess + 1) // 2
+    if end >= len(text):
+        return len(text), len(text)
+    # Слишком короткие части не нужны: граница ищется во второй половине
+    floor = start + (end - start) // 2
+    for separator in ('\n\n', '\n', ' '):
+        cut = text.rfind(separator, floor, end)
+        if cut > start:
+            return cut, cut + len(separator)
+    return end, end
+
+
+def _to_utf16(text: str, offsets: list) -> list:
+    """Позиции в символах Python -> позиции в единицах UTF-16"""
+    if len(text) == utf16_len(text):
+        return offsets
+    result = []
+    for offset in offsets:
+        result.append(utf16_len(text[:offset]))
+    return result
+
+
+def split_message(markdown: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Разбиение ответа в Markdown на сообщения.
+
+    Returns:
+        list: [(text, [MessageEntity])] - части не длиннее limit единиц UTF-16
+    """
+    text, entities = parse_markdown(markdown)
+    messages = []
+    start = 0
+    first_entity = 0  # Сущности до этой уже целиком в предыдущих частях
+    while start < len(text):
+        end, next_start = _find_cut(text, start, limit)
+        # Telegram обрезает пробелы по краям сообщения - обрезаем сами, чтобы не сдвинуть сущности
+        part_start, part_end = start, end
+        while part_start < part_end and text[part_start].isspace():
+            part_start += 1
+        while part_end > part_start and text[part_end - 1].isspace():
+            part_end -= 1
+        if part_start < part_end:
+            part = text[part_start:part_end]
+            clipped = []
+            for entity_type, entity_start, entity_end, extra in entities[first_entity:]:
+                if entity_start >= part_end:
+                    break
+                # Сущность на границе (обычно блок кода) продолжается в следующей части
+                clip_start, clip_end = max(entity_start, part_start), min(entity_end, part_end)
+                if clip_start < clip_end and part[clip_start - part_start:clip_end - part_start].strip():
+                    clipped.append((entity_type, clip_start - part_start, clip_end - part_start, extra))
+            positions = _to_utf16(part, [p for _, s, e, _ in clipped for p in (s, e)])
+            message_entities = []
+            for i, (entity_type, _, _, extra) in enumerate(clipped):
+                offset, entity_end = positions[2 * i], positions[2 * i + 1]
+                message_entities.append(MessageEntity(
+                    entity_type, offset, entity_end - offset,
+                    language=extra if entity_type == MessageEntity.PRE else None,
+                    url=extra if entity_type == MessageEntity.TEXT_LINK else None,
+                ))
+            messages.append((part, message_entities))
+        while first_entity < len(entities) and entities[first_entity][2] <= next_start:
+            first_entity += 1
+        start = next_start
+    return messages
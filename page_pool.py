@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
+
+
+class NoHealthyPages(Exception):
+    """В пуле нет ни одной рабочей вкладки (браузер не запущен или не восстановлен)"""
+
+
+class PageSlot:
+    """Вкладка браузера со своим собственным состоянием"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.page: Optional[Page] = None
+        self.current_user_id = None  # Пользователь, чей чат сейчас открыт во вкладке
+        self.project_url = None  # URL открытого проекта/чата этого пользователя
+        self.busy = False  # Вкладка занята генерацией
+        self.healthy = False  # Вкладка открыта и отвечает
+        self.first_request = True  # Флаг для первого запроса во вкладке
+        self.last_used = 0.0  # Время последнего освобождения (для выбора LRU)
+        self.jobs_done = 0
+
+    def attach(self, page: Page):
+        """Привязка новой страницы к слоту со сбросом состояния (рабочей она станет после открытия ChatGPT)"""
+        self.page = page
+        self.current_user_id = None
+        self.project_url = None
+        self.healthy = False
+        self.first_request = True
+
+    def __repr__(self):
+        return f"<PageSlot #{self.index} user={self.current_user_id} busy={self.busy} healthy={self.healthy}>"
+
+
+class PagePool:
+    """Пул вкладок браузера с диспетчером, выдающим задаче свободную вкладку"""
+
+    def __init__(self, size: int = 1):
+        self.size = max(1, size)
+        self.slots = [PageSlot(i) for i in range(self.size)]
+        self._condition = asyncio.Condition()
+
+    def _pick_idle(self, username: str) -> Optional[PageSlot]:
+        """Выбор свободной вкладки: сначала та, где уже открыт чат пользователя"""
+        idle = [slot for slot in self.slots if not slot.busy and slot.healthy and slot.page]
+        if not idle:
+            return None
+
+        # Вкладка, в которой уже открыт чат этого пользователя - без переключения
+        for slot in idle:
+            if slot.current_user_id == username:
+                return slot
+
+        # Вкладка, которая еще никем не занята
+        for slot in idle:
+            if slot.current_user_id is None:
+                return slot
+
+        # Иначе - дольше всех простаивающая вкладка
+        return min(idle, key=lambda slot: slot.last_used)
+
+    async def acquire(self, username: str) -> PageSlot:
+        """Ожидание и захват свободной вкладки
+
+        Raises:
+            NoHealthyPages: рабочих вкладок нет - ждать освобождения бесполезно
+        """
+        async with self._condition:
+            while True:
+                if not self.healthy_count():
+                    raise NoHealthyPages("нет рабочих вкладок браузера")
+                slot = self._pick_idle(username)
+                if slot:
+                    slot.busy = True
+                    logger.debug(f"Вкладка #{slot.index} выдана пользователю {username}")
+                    return slot
+                await self._condition.wait()
+
+    async def release(self, slot: PageSlot):
+        """Возврат вкладки в пул"""
+        async with self._condition:
+            slot.busy = False
+            slot.last_used = time.monotonic()
+            self._condition.notify_all()
+
+    async def notify(self):
+        """Пробуждение ожидающих задач (например, после восстановления вкладки)"""
+        async with self._condition:
+            self._condition.notify_all()
+
+    def busy_count(self) -> int:
+        return sum(1 for slot in self.slots if slot.busy)
+
+    def healthy_count(self) -> int:
+        return sum(1 for slot in self.slots if slot.healthy)
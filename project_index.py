@@ -0,0 +1,61 @@
+"""
+Индекс проектов пользователей: Telegram ID -> адрес проекта ChatGPT.
+Позволяет открывать проект прямой навигацией вместо поиска по боковой панели.
+Хранится в JSON-файле, запись атомарная (временный файл + os.replace) и выполняется
+в пуле файловых операций.
+"""
+import logging
+import re
+import time
+from typing import Optional
+
+from json_store import JsonStore
+
+logger = logging.getLogger(__name__)
+
+# Адрес проекта: https://chatgpt.com/g/<id проекта>/project, чаты проекта - /g/<id>/c/<id чата>
+_PROJECT_URL_RE = re.compile(r'^(https?://[^/]+/g/[^/?#]+)')
+
+
+def project_url_from(url: str) -> Optional[str]:
+    """Адрес страницы проекта по адресу любой его страницы (или None, если это не проект)"""
+    match = _PROJECT_URL_RE.match(url or '')
+    return match.group(1) + '/project' if match else None
+
+
+class ProjectIndex:
+    """Словарь user_id -> {'url': адрес проекта, 'updated': время}, сохраняемый на диск"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._store = JsonStore(path, 'индекса проектов', ensure_ascii=False, indent=1)
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        entries = self._store.load({})
+        if entries:
+            logger.info(f"Индекс проектов загружен: {len(entries)} пользователей")
+        return entries
+
+    def get(self, user_id: str) -> Optional[str]:
+        """Адрес проекта пользователя, если известен"""
+        entry = self._entries.get(user_id)
+        return entry['url'] if entry else None
+
+    async def set(self, user_id: str, url: str):
+        """Запоминание проекта пользователя (url - адрес любой страницы проекта)"""
+        project_url = project_url_from(url)
+        if not project_url or self.get(user_id) == project_url:
+            return
+        self._entries[user_id] = {'url': project_url, 'updated': int(time.time())}
+        logger.info(f"Проект пользователя {user_id} записан в индекс: {project_url}")
+        await self._save()
+
+    async def forget(self, user_id: str):
+        """Удаление устаревшей записи (проект удален или адрес больше не открывается)"""
+        if self._entries.pop(user_id, None) is not None:
+            logger.info(f"Запись проекта пользователя {user_id} удалена из индекса")
+            await self._save()
+
+    async def _save(self):
+        await self._store.save(lambda: dict(self._entries))
@@ -0,0 +1,20 @@
+"""
+Ключ текстового запроса для кэша ответов и объединения одинаковых запросов.
+Текст нормализуется (регистр и пробелы не учитываются). В области 'user' к ключу
+добавляется Telegram ID пользователя, в области 'global' ключ общий для всех.
+"""
+import re
+
+SCOPES = ('user', 'global')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """Текст запроса без различий в регистре и пробелах"""
+    return _WHITESPACE_RE.sub(' ', query).strip().casefold()
+
+
+def query_key(scope: str, user_id: str, query: str) -> str:
+    query = normalize_query(query)
+    return query if scope == 'global' else f"{user_id}:{query}"
@@ -0,0 +1,70 @@
+"""
+Кэш ответов ChatGPT на повторяющиеся запросы (включается явно).
+Ключ - нормализованный текст запроса (регистр и пробелы не учитываются), для
+области 'user' - еще и Telegram ID пользователя, для 'global' ответ общий для всех.
+Записи живут не дольше ttl секунд, при переполнении вытесняются давно не
+использованные. Содержимое сохраняется на диск атомарной записью и переживает перезапуск.
+Для ответа, разметка которого собрана из страницы (FormattedResponse), хранится и
+текст, и Markdown, чтобы повторный ответ выглядел так же, как первый.
+"""
+import logging
+from typing import Optional
+
+import tracing
+from formatting import FormattedResponse
+from json_store import JsonStore
+from query_key import SCOPES, query_key
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+tracing.metrics.describe('tgbot_response_cache_total', 'Поиски ответа в кэше (result=hit|miss|bypass)')
+tracing.metrics.describe('tgbot_response_cache_entries', 'Записей в кэше ответов')
+
+class ResponseCache:
+    """Нормализованный запрос (+ пользователь) -> текст ответа"""
+
+    def __init__(self, path: str, scope: str = 'user', ttl: float = 86400, max_entries: int = 1000):
+        if scope not in SCOPES:
+            raise ValueError(f"Неизвестная область кэша ответов: {scope}")
+        self.path = path
+        self.scope = scope
+        self._entries = TTLCache(max_entries, ttl)
+        self._store = JsonStore(path, 'кэша ответов', ensure_ascii=False)
+        self._load()
+
+    def _key(self, user_id: str, query: str) -> str:
+        return query_key(self.scope, user_id, query)
+
+    def _load(self):
+        entries = self._store.load()
+        if entries:
+            # Записи сохранены от старых к новым - порядок LRU восстанавливается
+            for key, expires_at, response in entries:
+                self._entries.put(key, response, expires_at)
+            # Просроченные за время простоя не учитываются
+            logger.info(f"Кэш ответов загружен: {len(self._entries.items())} записей")
+        tracing.metrics.set('tgbot_response_cache_entries', len(self._entries))
+
+    def get(self, user_id: str, query: str) -> Optional[str]:
+        """Сохраненный ответ на такой же запрос, если он еще не устарел"""
+        response = self._entries.get(self._key(user_id, query))
+        tracing.metrics.inc('tgbot_response_cache_total', result='miss' if response is None else 'hit')
+        if isinstance(response, list):
+            text, markdown = response
+            return FormattedResponse(text, markdown)
+        return response
+
+    def bypass(self):
+        """Учет запроса, выполненного мимо кэша по просьбе пользователя"""
+        tracing.metrics.inc('tgbot_response_cache_total', result='bypass')
+
+    async def put(self, user_id: str, query: str, response: str):
+        # Запись: строка или [текст, Markdown]
+        if isinstance(response, FormattedResponse):
+            value = [str(response), response.markdown]
+        else:
+            value = str(response)
+        self._entries.put(self._key(user_id, query), value)
+        tracing.metrics.set('tgbot_response_cache_entries', len(self._entries))
+        await self._store.save(self._entries.items)
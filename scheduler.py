@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Задача пользователя (текстовый запрос или фото)"""
+
+    def __init__(self, user_id: str, kind: str, run, request_id: str = None):
+        self.user_id = user_id
+        self.kind = kind  # 'text' или 'photo'
+        self.run = run  # Корутина-функция без аргументов, выполняющая задачу
+        self.request_id = request_id or tracing.new_request_id()
+        self.created_at = time.monotonic()
+
+
+class SchedulerBusy(Exception):
+    """Задача не принята: превышена квота пользователя или переполнена очередь"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason  # 'rate' - квота пользователя, 'queue' - общая очередь
+        self.retry_after = retry_after  # Через сколько секунд имеет смысл повторить
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def time_until_available(self, amount: float = 1.0) -> float:
+        """Секунд до появления нужного количества токенов"""
+        self._refill()
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class LatencyEstimator:
+    """Экспоненциальное скользящее среднее (EWMA) длительности задач"""
+
+    def __init__(self, alpha: float = 0.2, initial: float = 60.0):
+        self.alpha = alpha
+        self.value = initial
+        self.samples = 0
+
+    def observe(self, seconds: float):
+        if self.samples == 0:
+            # Первое измерение заменяет начальную оценку целиком
+            self.value = seconds
+        else:
+            self.value = self.alpha * seconds + (1 - self.alpha) * self.value
+        self.samples += 1
+
+
+class FairScheduler:
+    """Общий планировщик задач между обработчиками Telegram и BrowserManager.
+
+    Задачи одного пользователя выполняются строго по порядку, а пользователи
+    обслуживаются по кругу (round-robin), поэтому активный пользователь не может
+    занять все вкладки. Квоты задаются ведром токенов на пользователя, общая
+    глубина очереди ограничена - лишние задачи отклоняются с оценкой ожидания.
+    """
+
+    def __init__(self, workers: int = 1, max_queue_depth: int = 50,
+                 user_rate: float = 6 / 60, user_burst: float = 3, ewma_alpha: float = 0.2):
+        self.workers = max(1, workers)
+        self.max_queue_depth = max_queue_depth
+        self.user_rate = user_rate  # Токенов в секунду на пользователя
+        self.user_burst = user_burst  # Размер ведра: сколько запросов подряд можно отправить
+        self.latency = LatencyEstimator(alpha=ewma_alpha)
+
+        self._queues = {}  # user_id -> deque[Job] ожидающих задач
+        self._buckets = {}  # user_id -> TokenBucket
+        self._running = {}  # user_id -> Job, выполняемая сейчас
+        self._ready = deque()  # Круг пользователей, у которых есть задачи и нет выполняемой
+        self._condition = asyncio.Condition()
+        self._tasks = []
+
+    def start(self):
+        """Запуск рабочих задач (по одной на вкладку браузера)"""
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Планировщик запущен: исполнителей {self.workers}, очередь до {self.max_queue_depth}")
+
+    async def stop(self):
+        """Остановка исполнителей при завершении бота"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def estimate_wait(self, jobs_ahead: int) -> float:
+        """Оценка ожидания (сек) для задачи, перед которой jobs_ahead задач"""
+        return self.latency.value * math.ceil((jobs_ahead + 1) / self.workers)
+
+    async def submit(self, job: Job) -> int:
+        """Постановка задачи в очередь
+
+        Returns:
+            int: сколько задач этого пользователя выполняется/ожидает перед ней
+
+        Raises:
+            SchedulerBusy: квота пользователя исчерпана или очередь переполнена
+        """
+        async with self._condition:
+            total = self.pending_count()
+            if total >= self.max_queue_depth:
+                raise SchedulerBusy('queue', self.estimate_wait(total - self.max_queue_depth))
+
+            bucket = self._buckets.get(job.user_id)
+            if bucket is None:
+                bucket = self._buckets[job.user_id] = TokenBucket(self.user_rate, self.user_burst)
+            if not bucket.try_consume():
+                raise SchedulerBusy('rate', bucket.time_until_available())
+
+            queue = self._queues.setdefault(job.user_id, deque())
+            queue.append(job)
+            if job.user_id not in self._running and len(queue) == 1:
+                self._ready.append(job.user_id)
+                self._condition.notify()
+
+            position = len(queue) - 1 + (1 if job.user_id in self._running else 0)
+            logger.info(f"Задача {job.kind} пользователя {job.user_id} в очереди, позиция {position}, всего ожидает {total + 1}")
+            return position
+
+    async def _next_job(self) -> Job:
+        """Выбор следующей задачи по кругу пользователей"""
+        async with self._condition:
+            while not self._ready:
+                await self._condition.wait()
+            user_id = self._ready.popleft()
+            job = self._queues[user_id].popleft()
+            self._running[user_id] = job
+            return job
+
+    async def _finish_job(self, job: Job):
+        """Освобождение пользователя и возврат его в конец круга"""
+        async with self._condition:
+            self._running.pop(job.user_id, None)
+            queue = self._queues.get(job.user_id)
+            if queue:
+                self._ready.append(job.user_id)
+                self._condition.notify()
+            else:
+                self._queues.pop(job.user_id, None)
+                # Полное ведро не хранит состояния - можно забыть пользователя
+                bucket = self._buckets.get(job.user_id)
+                if bucket and bucket.is_full():
+                    del self._buckets[job.user_id]
+
+    async def _worker(self, index: int):
+        """Исполнитель: берет задачи по очереди и выполняет их"""
+        while True:
+            job = await self._next_job()
+            started = time.monotonic()
+            logger.debug(f"Исполнитель #{index}: задача {job.kind} пользователя {job.user_id}, ожидание {started - job.created_at:.1f} сек")
+            try:
+                with tracing.request_context(job.request_id, job.user_id):
+                    tracing.record('queue_wait', started - job.created_at)
+                    with tracing.span('job', kind=job.kind):
+                        await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка выполнения задачи пользователя {job.user_id}: {e}", exc_info=True)
+            finally:
+                self.latency.observe(time.monotonic() - started)
+                await self._finish_job(job)
+
+    def is_busy(self, user_id: str) -> bool:
+        return user_id in self._running
+
+    def pending(self, user_id: str) -> int:
+        """Количество задач пользователя, ожидающих выполнения"""
+        return len(self._queues.get(user_id, ()))
+
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def pending_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
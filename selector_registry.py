@@ -0,0 +1,105 @@
+"""
+Поиск элементов по списку селекторов-кандидатов.
+Все кандидаты ждутся одновременно одним объединенным локатором, поэтому худший
+случай - один таймаут, а не сумма таймаутов. Сработавший селектор запоминается
+для роли и языка интерфейса и в следующий раз проверяется первым.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from playwright.async_api import Page
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+tracing.metrics.describe('tgbot_selector_winner_changes_total', 'Смены сработавшего селектора для роли элемента')
+tracing.metrics.describe('tgbot_selector_misses_total', 'Поиски элемента, не нашедшие ни одного кандидата')
+
+
+class SelectorRegistry:
+    """Селекторы-победители по (роль, язык интерфейса)"""
+
+    def __init__(self):
+        self._winners = {}  # (role, locale) -> selector
+
+    @staticmethod
+    async def _locale(page: Page) -> str:
+        try:
+            return await page.evaluate('() => document.documentElement.lang || navigator.language || ""')
+        except Exception:
+            return ''
+
+    def ordered(self, role: str, locale: str, candidates: list) -> list:
+        """Кандидаты, начиная с запомненного победителя"""
+        winner = self._winners.get((role, locale))
+        if winner in candidates:
+            return [winner] + [c for c in candidates if c != winner]
+        return list(candidates)
+
+    def remember(self, role: str, locale: str, selector: str):
+        key = (role, locale)
+        previous = self._winners.get(key)
+        if previous == selector:
+            return
+        self._winners[key] = selector
+        if previous is not None:
+            tracing.metrics.inc('tgbot_selector_winner_changes_total', role=role)
+            logger.warning(f"Селектор для '{role}' ({locale or '?'}) сменился: `{previous}` -> `{selector}`")
+        else:
+            logger.info(f"Селектор для '{role}' ({locale or '?'}): `{selector}`")
+
+    @staticmethod
+    def _full_selector(selector: str, state: str) -> str:
+        return f'{selector} >> visible=true' if state == 'visible' else selector
+
+    def _locator(self, page: Page, selector: str, state: str):
+        return page.locator(self._full_selector(selector, state))
+
+    async def resolve(self, page: Page, role: str, candidates: list, timeout: float = 10,
+                      state: str = 'visible') -> Optional[str]:
+        """
+        Ожидание любого из кандидатов.
+
+        Returns:
+            str: селектор найденного элемента для page.click/fill (при state='visible'
+                 с фильтром видимости) или None, если за timeout секунд ничего не нашлось
+        """
+        locale = await self._locale(page)
+        ordered = self.ordered(role, locale, candidates)
+
+        union = None
+        for selector in ordered:
+            locator = self._locator(page, selector, state)
+            union = locator if union is None else union.or_(locator)
+
+        try:
+            await union.first.wait_for(state='attached', timeout=timeout * 1000)
+        except Exception:
+            tracing.metrics.inc('tgbot_selector_misses_total', role=role)
+            logger.debug(f"Ни один селектор для '{role}' не найден за {timeout} сек")
+            return None
+
+        # Какой именно кандидат сработал: проверяем все сразу, приоритет - по порядку
+        counts = await asyncio.gather(
+            *(self._locator(page, selector, state).count() for selector in ordered),
+            return_exceptions=True,
+        )
+        for selector, count in zip(ordered, counts):
+            if isinstance(count, int) and count > 0:
+                self.remember(role, locale, selector)
+                return self._full_selector(selector, state)
+        return None
+
+    async def query(self, page: Page, role: str, candidates: list, timeout: float = 10,
+                    state: str = 'visible'):
+        """Как resolve, но возвращает сам элемент (ElementHandle) или None"""
+        selector = await self.resolve(page, role, candidates, timeout, state)
+        if selector is None:
+            return None
+        return await page.query_selector(selector)
+
+
+# Общий реестр на процесс: раскладка страницы одинакова во всех вкладках
+registry = SelectorRegistry()
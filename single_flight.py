@@ -0,0 +1,86 @@
+"""
+Объединение одинаковых запросов, выполняющихся одновременно (single-flight).
+Если такой же нормализованный запрос (в той же области: пользователь или все)
+уже стоит в очереди или выполняется в браузере, новый запрос не порождает второй
+генерации, а дожидается результата первого и получает тот же ответ и файлы.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import tracing
+from query_key import SCOPES, query_key
+
+logger = logging.getLogger(__name__)
+
+tracing.metrics.describe('tgbot_single_flight_total', 'Текстовые запросы по роли в объединении (role=leader|follower)')
+
+class Flight:
+    """Выполняющийся запрос, к результату которого могут присоединиться другие"""
+
+    def __init__(self, group: 'SingleFlight', key: str):
+        self._group = group
+        self.key = key
+        self.followers = 0
+        self._future = asyncio.get_running_loop().create_future()
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def resolve(self, response: str, artifacts):
+        """Результат ведущего запроса; каждый присоединившийся получает свою ссылку на файлы"""
+        if self.done():
+            return
+        self._group._finish(self)
+        artifacts.retain(self.followers)
+        self._future.set_result((response, artifacts))
+
+    def fail(self, error: BaseException):
+        """Ведущий запрос не выполнен - присоединившиеся получают ту же ошибку"""
+        if self.done():
+            return
+        self._group._finish(self)
+        self._future.set_exception(error)
+        # Без присоединившихся исключение никто не прочитает
+        if not self.followers:
+            self._future.exception()
+
+    async def wait(self) -> tuple:
+        """(response_text, ArtifactBatch) ведущего запроса; файлы нужно закрыть после отправки"""
+        # Отмена одного ожидающего не должна отменять общий результат
+        return await asyncio.shield(self._future)
+
+
+class SingleFlight:
+    """Реестр выполняющихся запросов по ключу (область, нормализованный текст)"""
+
+    def __init__(self, scope: str = 'user'):
+        if scope not in SCOPES:
+            raise ValueError(f"Неизвестная область объединения запросов: {scope}")
+        self.scope = scope
+        self._flights = {}
+
+    def _key(self, user_id: str, query: str) -> str:
+        return query_key(self.scope, user_id, query)
+
+    def join(self, user_id: str, query: str) -> Optional[Flight]:
+        """Присоединение к такому же выполняющемуся запросу (None - такого нет)"""
+        flight = self._flights.get(self._key(user_id, query))
+        if flight is None:
+            return None
+        flight.followers += 1
+        tracing.metrics.inc('tgbot_single_flight_total', role='follower')
+        logger.info(f"Запрос от ID {user_id} присоединен к выполняющемуся ({flight.followers} ожидающих)")
+        return flight
+
+    def begin(self, user_id: str, query: str) -> Flight:
+        """Регистрация нового ведущего запроса"""
+        flight = Flight(self, self._key(user_id, query))
+        self._flights[flight.key] = flight
+        tracing.metrics.inc('tgbot_single_flight_total', role='leader')
+        return flight
+
+    def _finish(self, flight: Flight):
+        # После результата новые запросы уже не присоединяются, а выполняются заново
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
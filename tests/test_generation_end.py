@@ -0,0 +1,68 @@
+"""
+Окончание генерации на локальном стенде чата (bench/chat.html) в настоящем браузере.
+Нужны playwright и установленный Chromium (playwright install chromium).
+"""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('playwright')
+
+from playwright.async_api import async_playwright  # noqa: E402
+
+from bench.fake_chat_app import FakeChatApp  # noqa: E402
+from browser_manager import BrowserManager, IncompleteResponse  # noqa: E402
+
+
+@pytest.fixture
+def chat_app():
+    app = FakeChatApp(token_rate=200, first_token_ms=100)
+    app.start()
+    yield app
+    app.stop()
+
+
+async def _ask(manager: BrowserManager, page, prompt: str):
+    await page.fill('#prompt-textarea', prompt)
+    baseline = await manager._count_assistant_messages(page)
+    await page.keyboard.press('Enter')
+    return baseline
+
+
+async def _run(url: str, tmp_path, check):
+    async with async_playwright() as playwright:
+        try:
+            browser = await playwright.chromium.launch()
+        except Exception as e:
+            pytest.skip(f"Chromium недоступен: {e}")
+        try:
+            page = await browser.new_page()
+            await page.goto(url)
+            manager = BrowserManager(str(tmp_path / 'profile'), headless=True,
+                                     project_index_path=str(tmp_path / 'project_index.json'))
+            await check(manager, page)
+        finally:
+            await browser.close()
+
+
+def test_image_only_answer_finishes_without_timeout(chat_app, tmp_path):
+    async def check(manager, page):
+        baseline = await _ask(manager, page, 'q:img [image-only]')
+        started = time.monotonic()
+        finished = await manager._wait_for_generation_end(page, baseline, timeout=20)
+        assert finished
+        # Ответ без текста не должен ждать idle-таймаута или GENERATION_TIMEOUT
+        assert time.monotonic() - started < 5
+
+    asyncio.run(_run(chat_app.url, tmp_path, check))
+
+
+def test_image_only_answer_is_complete(chat_app, tmp_path):
+    async def check(manager, page):
+        baseline = await _ask(manager, page, 'q:img [image-only]')
+        response = await manager._wait_for_response(page, baseline)
+        assert response == "Изображение создано"
+        assert not isinstance(response, IncompleteResponse)
+
+    asyncio.run(_run(chat_app.url, tmp_path, check))
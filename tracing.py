@@ -0,0 +1,245 @@
+"""
+Трассировка этапов обработки запросов.
+Длительность каждого этапа (span) попадает в гистограммы, которые отдаются
+в формате Prometheus по локальному HTTP, и, если задан файл, в JSONL-трассу.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительностей (сек)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Текущий запрос: (request_id, user_id), наследуется вложенными корутинами
+_current_request = contextvars.ContextVar('current_request', default=(None, None))
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Гистограммы и счетчики с метками, отображаемые в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> float
+        self._gauges = {}  # (name, labels) -> float
+        self._help = {}  # name -> описание
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS, **labels):
+        key = self._key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self._gauges[self._key(name, labels)] = value
+
+    @staticmethod
+    def _format_labels(labels, extra: tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{key}="{_escape_label(value)}"' for key, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self) -> str:
+        """Текст для эндпоинта /metrics"""
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name in typed:
+                return
+            typed.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(self._gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('tgbot_stage_seconds', 'Длительность этапов обработки запроса')
+
+# Записи JSONL-трассы, ожидающие сброса в файл
+_trace_file = None
+_trace_buffer = []
+_flush_task = None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def request_context(request_id: str, user_id: str):
+    """Привязка последующих этапов к запросу (в пределах текущей задачи asyncio)"""
+    token = _current_request.set((request_id, user_id))
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+def record(stage: str, duration: float, ok: bool = True, **fields):
+    """Учет уже измеренного этапа"""
+    metrics.observe('tgbot_stage_seconds', duration, stage=stage)
+    if _trace_file:
+        request_id, user_id = _current_request.get()
+        entry = {
+            'ts': round(time.time(), 3),
+            'request_id': request_id,
+            'user_id': user_id,
+            'stage': stage,
+            'duration': round(duration, 4),
+            'ok': ok,
+        }
+        entry.update(fields)
+        _trace_buffer.append(entry)
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Измерение длительности этапа: with tracing.span('generation'): ..."""
+    started = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, ok, **fields)
+
+
+def _write_trace(path: str, entries: list):
+    with open(path, 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+async def flush_trace():
+    """Сброс накопленных записей трассы в файл вне цикла событий"""
+    global _trace_buffer
+    if not _trace_file or not _trace_buffer:
+        return
+    entries, _trace_buffer = _trace_buffer, []
+    # file_ops сам импортирует tracing - импорт здесь, чтобы не было цикла при загрузке
+    import file_ops
+    try:
+        await file_ops.run('trace_write', _write_trace, _trace_file, entries)
+    except Exception as e:
+        logger.error(f"Ошибка записи трассы: {e}")
+
+
+async def _flush_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await flush_trace()
+
+
+def configure_trace_file(path: str, flush_interval: float = 1.0):
+    """Включение JSONL-трассы этапов"""
+    global _trace_file, _flush_task
+    _trace_file = path
+    _flush_task = asyncio.create_task(_flush_loop(flush_interval))
+    logger.info(f"Трасса запросов пишется в {path}")
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Минимальный HTTP-обработчик: GET /metrics"""
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        # Заголовки запроса не нужны, просто вычитываем их
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', metrics.render().encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'not found\n'
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"Ошибка обработки запроса метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int, host: str = '127.0.0.1'):
+    """Запуск HTTP-эндпоинта с метриками"""
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+async def shutdown(server=None):
+    """Остановка эндпоинта и сброс трассы"""
+    if _flush_task:
+        _flush_task.cancel()
+    if server:
+        server.close()
+        await server.wait_closed()
+    await flush_trace()
@@ -0,0 +1,40 @@
+"""
+Словарь с ограничением размера (LRU) и временем жизни записей (TTL).
+"""
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Не больше max_entries записей, каждая живет не дольше ttl секунд"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (срок годности, значение)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, expires_at: float = None):
+        """Запись значения; expires_at - абсолютное время (по умолчанию сейчас + ttl)"""
+        self._entries[key] = (expires_at or time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def items(self) -> list:
+        """Непросроченные записи: [(key, expires_at, value)] от старых к новым"""
+        now = time.time()
+        return [(key, expires_at, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def __len__(self):
+        return len(self._entries)
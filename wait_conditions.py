@@ -0,0 +1,111 @@
+"""
+Ожидание готовности страницы ChatGPT по условиям вместо фиксированных пауз.
+Каждая функция ждет, пока условие выполнится, но не дольше timeout секунд,
+и возвращает True/False вместо исключения - вызывающий код решает, что делать дальше.
+"""
+import asyncio
+import logging
+
+from playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
+
+# Поле ввода запроса
+INPUT_SELECTOR = '#prompt-textarea, textarea, div[contenteditable="true"]'
+
+# Кнопка отправки, ставшая активной после ввода текста/загрузки файла
+SEND_READY_SELECTOR = 'button[data-testid="send-button"]:not([disabled])'
+
+# Список проектов/чатов в боковой панели
+SIDEBAR_SELECTOR = 'nav a[href*="/g/"], nav a[href*="/c/"], nav :text("Новый проект"), nav :text("New project")'
+
+# Превью загруженного файла в поле ввода
+UPLOAD_CHIP_SELECTOR = (
+    '[data-testid*="attachment"], '
+    'div[class*="file-tile"], '
+    'img[alt*="Uploaded"], '
+    'img[alt*="Загруженн"]'
+)
+
+# Модальное окно (создание проекта, "Поделиться")
+DIALOG_SELECTOR = 'div[role="dialog"]'
+
+# Текст Cloudflare-проверки
+CAPTCHA_SELECTOR = ':text("Подтвердите, что вы человек")'
+
+
+async def wait_until(check, timeout: float, interval: float = 0.1, description: str = "") -> bool:
+    """Ожидание, пока корутина-функция check() не вернет истину"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            if await check():
+                return True
+        except Exception as e:
+            logger.debug(f"Проверка условия '{description}' не удалась: {e}")
+        if loop.time() >= deadline:
+            if description:
+                logger.debug(f"Условие не выполнено за {timeout} сек: {description}")
+            return False
+        await asyncio.sleep(interval)
+
+
+async def wait_for_selector(page: Page, selector: str, timeout: float, state: str = 'visible') -> bool:
+    """Ожидание элемента в нужном состоянии"""
+    try:
+        await page.wait_for_selector(selector, timeout=timeout * 1000, state=state)
+        return True
+    except Exception:
+        logger.debug(f"Элемент `{selector}` не перешел в состояние {state} за {timeout} сек")
+        return False
+
+
+async def wait_for_input_ready(page: Page, timeout: float = 15) -> bool:
+    """Поле ввода запроса отображено"""
+    return await wait_for_selector(page, INPUT_SELECTOR, timeout)
+
+
+async def wait_for_app_ready(page: Page, timeout: float = 15) -> bool:
+    """Страница загрузилась: появилось поле ввода или Cloudflare-проверка"""
+    return await wait_for_selector(page, f'{INPUT_SELECTOR}, {CAPTCHA_SELECTOR}', timeout)
+
+
+async def wait_for_send_ready(page: Page, timeout: float = 5) -> bool:
+    """Кнопка отправки стала активной (текст введен, файлы загружены)"""
+    return await wait_for_selector(page, SEND_READY_SELECTOR, timeout)
+
+
+async def wait_for_sidebar(page: Page, timeout: float = 10) -> bool:
+    """Боковая панель со списком проектов отрисована"""
+    return await wait_for_selector(page, SIDEBAR_SELECTOR, timeout, state='attached')
+
+
+async def wait_for_url_change(page: Page, previous_url: str, timeout: float = 10) -> bool:
+    """Адрес страницы изменился (в том числе при навигации без перезагрузки)"""
+    try:
+        await page.wait_for_function('(url) => location.href !== url', arg=previous_url, timeout=timeout * 1000)
+        return True
+    except Exception:
+        logger.debug(f"Адрес страницы не изменился за {timeout} сек: {previous_url}")
+        return False
+
+
+async def wait_for_project_page(page: Page, previous_url: str, timeout: float = 10) -> bool:
+    """Открыта страница проекта/чата и она готова к вводу"""
+    if page.url == previous_url and not await wait_for_url_change(page, previous_url, timeout):
+        return False
+    return await wait_for_input_ready(page, timeout)
+
+
+async def wait_for_upload_chip(page: Page, timeout: float = 15) -> bool:
+    """Загруженный файл отрисован в поле ввода и отправка разрешена"""
+    if not await wait_for_selector(page, UPLOAD_CHIP_SELECTOR, timeout, state='attached'):
+        return False
+    # Пока файл загружается на сервер, кнопка отправки неактивна
+    return await wait_for_send_ready(page, timeout)
+
+
+async def wait_for_dialog(page: Page, timeout: float = 5, hidden: bool = False) -> bool:
+    """Модальное окно появилось (или закрылось при hidden=True)"""
+    return await wait_for_selector(page, DIALOG_SELECTOR, timeout, state='hidden' if hidden else 'visible')